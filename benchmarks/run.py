@@ -0,0 +1,241 @@
+"""
+Benchmark suite for the data pipeline and the recommenders.
+
+    python -m benchmarks.run --rows 5000 50000 500000 --out results.json
+    python -m benchmarks.run --compare old.json new.json
+
+For each scale a synthetic TMDB corpus is generated (and kept under benchmarks/data),
+and every stage runs in a fresh process in a scratch directory: read_csv_to_df,
+stemming_stopwords, the artifact build, Main.vectorise, artifact load (Main.get_df and
+the serving snapshot), recommend, recommend_all and get_details. Each stage records
+its wall time and the process peak RSS; --memory also traces the peak Python/NumPy
+allocation of each stage, at some cost in speed. Results are JSON, so runs from
+different commits can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, 'benchmarks', 'data')
+
+# The all-pairs similarity product is only attempted up to this many rows
+VECTORISE_MAX_ROWS = 20000
+
+# Above this, the neighbour index build is replaced by query mode unless --mode is given; the
+# blocked build keeps its memory bounded, but its time still grows with the square of the catalog
+NEIGHBORS_MAX_ROWS = 50000
+
+# Stages slower than this factor are flagged by --compare
+REGRESSION_FACTOR = 1.1
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+class Stages():
+    """
+    Times named stages in the worker process and collects their measurements.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, name, fn, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        value = fn(*args, **kwargs)
+        seconds = time.perf_counter() - started
+
+        result = {'seconds': round(seconds, 4), 'peak_rss_mb': _peak_rss_mb()}
+        if self.trace_memory:
+            result['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        self.results[name] = result
+        print(f'  {name}: {seconds:.3f}s', flush=True)
+        return value
+
+    def latencies(self, name, fn, items):
+        # Per-call latency distribution of fn over items, in milliseconds
+        times = []
+        for item in items:
+            started = time.perf_counter()
+            fn(item)
+            times.append(1000 * (time.perf_counter() - started))
+        times = np.array(times)
+        self.results[name] = {'calls': len(times), 'seconds': round(times.sum() / 1000, 4),
+                              'mean_ms': round(float(times.mean()), 3),
+                              'p50_ms': round(float(np.percentile(times, 50)), 3),
+                              'p95_ms': round(float(np.percentile(times, 95)), 3), 'peak_rss_mb': _peak_rss_mb()}
+        print(f'  {name}: {times.mean():.2f} ms mean over {len(times)} calls', flush=True)
+
+
+def run_stages(rows, queries, trace_memory):
+    """
+    Runs in the scratch directory, whose Files/ holds the corpus CSVs.
+    """
+    # Imported here so the environment set up by the parent applies to module constants
+    from processing import preprocess
+    from processing.artifacts import current_artifacts
+    from processing.display import Main
+    from processing.similarity import RECOMMEND_MODE, STRATEGIES
+
+    stages = Stages(trace_memory)
+    timings = {}
+    movies, new_df, movies2 = stages.run('read_csv_to_df', preprocess.read_csv_to_df, timings=timings)
+    stages.results['read_csv_to_df']['parts'] = {name: round(seconds, 4) for name, seconds in timings.items()}
+
+    # A cold stopword set and stem cache, as on the first build of a process
+    preprocess._shared_normaliser = None
+    overviews = movies['overview'].tolist()
+    stages.run('stemming_stopwords', lambda: [preprocess.stemming_stopwords(tokens) for tokens in overviews])
+    del movies, new_df, movies2
+
+    def build():
+        with Main(rebuild=True) as bot:
+            bot.main_()
+
+    stages.run('build', build)
+    if rows <= VECTORISE_MAX_ROWS:
+        with Main() as bot:
+            stages.run('vectorise', bot.vectorise, 'tags')
+
+    with Main() as bot:
+        stages.run('get_df', bot.get_df)
+    artifacts = stages.run('load_artifacts', current_artifacts)
+
+    new_df = artifacts.new_df
+    titles = new_df['title'].to_numpy()[np.random.default_rng(0).choice(len(new_df), queries, replace=False)]
+    stages.latencies('recommend', lambda title: preprocess.recommend(new_df, title, 'tags'), titles)
+    stages.latencies('recommend_all', lambda title: preprocess.recommend_all(new_df, title, STRATEGIES), titles)
+    stages.latencies('get_details', lambda title: preprocess.get_details(new_df, title), titles[:max(1, queries // 4)])
+    return {'rows': rows, 'mode': RECOMMEND_MODE, 'stages': stages.results}
+
+
+def corpus(rows, seed):
+    # Generated once per scale and seed, then reused by every run
+    from benchmarks.synthetic import generate
+
+    directory = os.path.join(DATA_DIR, f'{rows}-{seed}')
+    paths = [os.path.join(directory, 'tmdb_5000_movies.csv'), os.path.join(directory, 'tmdb_5000_credits.csv')]
+    if not all(os.path.exists(path) for path in paths):
+        print(f'Generating a {rows}-row corpus in {directory}', flush=True)
+        generate(directory + '.tmp', rows, seed)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(directory + '.tmp', directory)
+    return paths
+
+
+def run_scale(rows, seed, mode, queries, trace_memory):
+    csv_paths = corpus(rows, seed)
+    mode = mode or ('neighbors' if rows <= NEIGHBORS_MAX_ROWS else 'query')
+    print(f'{rows} rows, {mode} mode', flush=True)
+
+    workdir = tempfile.mkdtemp(prefix='cinescope-bench-')
+    try:
+        os.makedirs(os.path.join(workdir, 'Files'))
+        for path in csv_paths:
+            os.symlink(path, os.path.join(workdir, 'Files', os.path.basename(path)))
+
+        result_path = os.path.join(workdir, 'result.json')
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, CINESCOPE_RECOMMEND_MODE=mode,
+                   # TMDB is never called; get_details then measures local work only
+                   CINESCOPE_TMDB_OFFLINE='1')
+        command = [sys.executable, '-m', 'benchmarks.run', '--worker', str(rows), '--result', result_path,
+                   '--queries', str(min(queries, rows))]
+        if trace_memory:
+            command.append('--memory')
+        subprocess.run(command, cwd=workdir, env=env, check=True)
+        with open(result_path) as result_file:
+            return json.load(result_file)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_runs = {(run['rows'], run['mode']): run['stages'] for run in old['runs']}
+
+    print(f"{old.get('commit') or old_path} -> {new.get('commit') or new_path}")
+    if old.get('memory_traced') != new.get('memory_traced'):
+        print('Only one of the runs traced memory; its timings include the tracing overhead')
+    for run in new['runs']:
+        before = old_runs.get((run['rows'], run['mode']))
+        if before is None:
+            continue
+        print(f"{run['rows']} rows, {run['mode']} mode")
+        for name, stage in run['stages'].items():
+            if name not in before:
+                continue
+            key = 'mean_ms' if 'mean_ms' in stage else 'seconds'
+            ratio = stage[key] / before[name][key] if before[name][key] else float('inf')
+            flag = '  slower' if ratio > REGRESSION_FACTOR else ''
+            print(f'  {name}: {before[name][key]:.3f} -> {stage[key]:.3f} {key} ({ratio:.2f}x){flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory-profile the CineScope pipeline on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 500000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['neighbors', 'query', 'ann', 'embedding'],
+                        help=f'recommend mode (default: neighbors up to {NEIGHBORS_MAX_ROWS} rows, then query)')
+    parser.add_argument('--queries', type=int, default=200, help='movies queried by the latency stages')
+    parser.add_argument('--memory', action='store_true', help='trace the peak allocation of every stage')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.worker:
+        with open(args.result, 'w') as result_file:
+            json.dump(run_stages(args.worker, args.queries, args.memory), result_file)
+        return
+
+    results = {'commit': _commit(), 'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'memory_traced': args.memory, 'seed': args.seed, 'runs': []}
+    for rows in args.rows:
+        results['runs'].append(run_scale(rows, args.seed, args.mode, args.queries, args.memory))
+        # Written after every scale, so a long run still leaves usable results
+        with open(args.out, 'w') as out_file:
+            json.dump(results, out_file, indent=1)
+    print(f'Results written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Synthetic TMDB-shaped corpora.
+
+    python -m benchmarks.synthetic out_dir --rows 50000
+
+Writes tmdb_5000_movies.csv and tmdb_5000_credits.csv in the TMDB 5000 format, with
+the same JSON-in-CSV list columns. Sizes roughly follow the real export: ~50-word
+overviews, 1-4 genres, ~7 keywords, ~20 cast and ~25 crew entries, ~3 production
+companies. Words and names are drawn from Zipf-like distributions so that common
+terms repeat across movies the way they do in the real catalog. Output is
+deterministic for a given seed; chunks are generated on a process pool and
+written in order, so 500k rows never sit in memory at once.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+
+MOVIES_COLUMNS = ['budget', 'genres', 'homepage', 'id', 'keywords', 'original_language', 'original_title', 'overview',
+                  'popularity', 'production_companies', 'production_countries', 'release_date', 'revenue', 'runtime',
+                  'spoken_languages', 'status', 'tagline', 'title', 'vote_average', 'vote_count']
+CREDITS_COLUMNS = ['movie_id', 'title', 'cast', 'crew']
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', 'Fantasy',
+          'Foreign', 'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction', 'TV Movie', 'Thriller',
+          'War', 'Western']
+LANGUAGES = [('en', 'English'), ('fr', 'Français'), ('es', 'Español'), ('de', 'Deutsch'), ('it', 'Italiano'),
+             ('ja', '日本語'), ('zh', '普通话'), ('ru', 'Pусский'), ('hi', 'हिन्दी'), ('ko', '한국어/조선말')]
+JOBS = ['Producer', 'Screenplay', 'Editor', 'Original Music Composer', 'Director of Photography', 'Casting',
+        'Executive Producer', 'Production Design', 'Costume Design', 'Sound Designer']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tor', 'va', 'sel', 'dun', 'bri', 'ho', 'qua', 'zen', 'pa', 'ti', 'mor', 'el',
+             'an', 'gu', 'ste', 'ry', 'fen', 'cal', 'do', 'wis', 'ny', 'ar', 'ble', 'ox', 'ju', 'pe']
+
+CHUNK_ROWS = 10000
+
+
+def _words(rng, count, min_syllables=2, max_syllables=4):
+    # Distinct pronounceable tokens, built from random syllables
+    words = set()
+    while len(words) < count:
+        lengths = rng.integers(min_syllables, max_syllables + 1, size=count).tolist()
+        parts = rng.integers(0, len(SYLLABLES), size=(count, max_syllables)).tolist()
+        for length, syllables in zip(lengths, parts):
+            words.add(''.join(SYLLABLES[i] for i in syllables[:length]))
+    return sorted(words)[:count]
+
+
+def _names(rng, count, first, last):
+    # Given name x family name, with a generation suffix once the combinations run out
+    names = []
+    for i in rng.permutation(count):
+        name = f'{first[i % len(first)].title()} {last[(i // len(first)) % len(last)].title()}'
+        generation = i // (len(first) * len(last))
+        names.append(f'{name} {generation + 1}' if generation else name)
+    return names
+
+
+class Zipf():
+    """
+    Draws indices into a pool of `size` items with probability proportional to 1 / rank ** s.
+    """
+
+    def __init__(self, size, s=1.1):
+        weights = 1.0 / np.arange(1, size + 1) ** s
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def draw(self, rng, count):
+        return np.minimum(np.searchsorted(self.cdf, rng.random(count)), len(self.cdf) - 1)
+
+
+def _json_list(items):
+    return json.dumps(items, ensure_ascii=False)
+
+
+class _Pools():
+    """
+    Words, keywords, people and companies shared by every chunk, derived from the seed only.
+    """
+
+    def __init__(self, rows, seed):
+        rng = np.random.default_rng(seed)
+        self.vocabulary = _words(rng, 20000)
+        self.keywords = _words(rng, 10000, 1, 3)
+        given, family = _words(rng, 400, 1, 2), _words(rng, 600, 2, 3)
+        self.people = _names(rng, max(2000, rows * 2), given, family)
+        suffixes = np.resize(['Pictures', 'Films', 'Studios', 'Entertainment', 'Media'], 5000)
+        self.companies = [f'{name.title()} {suffix}' for name, suffix in zip(_words(rng, 5000, 2, 3), suffixes)]
+
+        self.word_dist, self.keyword_dist = Zipf(len(self.vocabulary)), Zipf(len(self.keywords))
+        self.people_dist, self.company_dist = Zipf(len(self.people), 0.8), Zipf(len(self.companies))
+
+
+_pools = None
+
+
+def _init_worker(rows, seed):
+    global _pools
+    _pools = _Pools(rows, seed)
+
+
+def _chunk(seed, start, end):
+    """
+    CSV text of the movies and credits rows start..end. Each chunk has its own random
+    stream, so the output does not depend on how chunks are spread over workers.
+    """
+    pools = _pools
+    vocabulary, keywords, people, companies = pools.vocabulary, pools.keywords, pools.people, pools.companies
+    rng = np.random.default_rng([seed, start])
+    movies_text, credits_text = io.StringIO(), io.StringIO()
+    movies_writer, credits_writer = csv.writer(movies_text), csv.writer(credits_text)
+
+    for movie_id in range(start, end):
+        title_words = [vocabulary[i].title() for i in pools.word_dist.draw(rng, rng.integers(1, 4))]
+        # The numeric suffix keeps titles unique, as the frames are merged on title
+        title = f"{' '.join(title_words)} {movie_id}"
+        overview = ' '.join(vocabulary[i] for i in pools.word_dist.draw(rng, max(5, int(rng.normal(50, 20)))))
+        genres = [{'id': 10000 + int(i), 'name': GENRES[i]}
+                  for i in rng.choice(len(GENRES), rng.integers(1, 5), replace=False)]
+        movie_keywords = [{'id': int(i), 'name': keywords[i]}
+                          for i in np.unique(pools.keyword_dist.draw(rng, rng.poisson(7)))]
+        movie_companies = [{'name': companies[i], 'id': int(i)}
+                           for i in np.unique(pools.company_dist.draw(rng, rng.integers(0, 7)))]
+        code, language = LANGUAGES[min(int(rng.exponential(1.2)), len(LANGUAGES) - 1)]
+        movies_writer.writerow([
+            int(rng.integers(0, 200)) * 1000000, _json_list(genres), '', movie_id, _json_list(movie_keywords),
+            code, title, overview, round(float(rng.exponential(20)), 6), _json_list(movie_companies),
+            _json_list([{'iso_3166_1': 'US', 'name': 'United States of America'}]),
+            f'{rng.integers(1916, 2017)}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}',
+            int(rng.integers(0, 1000)) * 1000000, float(rng.integers(60, 200)),
+            _json_list([{'iso_639_1': code, 'name': language}]), 'Released', '', title,
+            round(float(rng.uniform(0, 10)), 1), int(rng.exponential(700)),
+        ])
+
+        cast = [{'cast_id': order, 'character': vocabulary[int(i) % len(vocabulary)].title(),
+                 'credit_id': f'{movie_id:x}c{order}', 'gender': int(i) % 3, 'id': int(i),
+                 'name': people[i], 'order': order}
+                for order, i in enumerate(pools.people_dist.draw(rng, rng.integers(1, 40)))]
+        crew = [{'credit_id': f'{movie_id:x}d', 'department': 'Directing', 'gender': int(i) % 3,
+                 'id': int(i), 'job': 'Director', 'name': people[i]}
+                for i in pools.people_dist.draw(rng, 1)]
+        crew += [{'credit_id': f'{movie_id:x}w{n}', 'department': 'Crew', 'gender': int(i) % 3,
+                  'id': int(i), 'job': JOBS[n % len(JOBS)], 'name': people[i]}
+                 for n, i in enumerate(pools.people_dist.draw(rng, rng.integers(0, 50)))]
+        credits_writer.writerow([movie_id, title, _json_list(cast), _json_list(crew)])
+
+    return movies_text.getvalue(), credits_text.getvalue()
+
+
+def generate(directory, rows, seed=0, workers=None):
+    """
+    Write both CSVs for `rows` movies into `directory`, generating chunks on a
+    process pool. Returns their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    chunks = [(seed, start, min(start + CHUNK_ROWS, rows)) for start in range(0, rows, CHUNK_ROWS)]
+
+    movies_path = os.path.join(directory, 'tmdb_5000_movies.csv')
+    credits_path = os.path.join(directory, 'tmdb_5000_credits.csv')
+    with open(movies_path, 'w', newline='', encoding='utf-8') as movies_file, \
+            open(credits_path, 'w', newline='', encoding='utf-8') as credits_file:
+        csv.writer(movies_file).writerow(MOVIES_COLUMNS)
+        csv.writer(credits_file).writerow(CREDITS_COLUMNS)
+
+        if workers == 1 or len(chunks) == 1:
+            _init_worker(rows, seed)
+            results = (_chunk(*chunk) for chunk in chunks)
+            for movies_text, credits_text in results:
+                movies_file.write(movies_text)
+                credits_file.write(credits_text)
+            return movies_path, credits_path
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=_init_worker, initargs=(rows, seed)) as executor:
+            # At most two chunks per worker in flight, so memory stays bounded at 500k rows
+            for window in range(0, len(chunks), workers * 2):
+                for movies_text, credits_text in executor.map(_chunk, *zip(*chunks[window:window + workers * 2])):
+                    movies_file.write(movies_text)
+                    credits_file.write(credits_text)
+    return movies_path, credits_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic TMDB 5000 format movies and credits CSVs.')
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    for path in generate(args.directory, args.rows, args.seed, args.workers):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
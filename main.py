@@ -1,8 +1,13 @@
+import uuid
 import streamlit as st
 import streamlit_option_menu
 from streamlit_extras.stoggle import stoggle
 from processing import preprocess
-from processing.display import Main
+from processing.artifacts import current_artifacts
+from processing.lookup import lookup_for
+from processing.metrics import METRICS_SIDEBAR, count, prometheus_text, registry, span, span_summary, \
+    start_file_writer
+from processing.prefetch import page_jobs, prefetcher
 
 # Setting the wide mode as default
 st.set_page_config(
@@ -13,13 +18,16 @@ st.set_page_config(
 
 displayed = []
 RECOMMENDER_CONFIG = [
-    ("Overall similarity", r'Files/similarity_tags_tags.pkl'),
-    ("Genre overlap", r'Files/similarity_tags_genres.pkl'),
-    ("Shared production", r'Files/similarity_tags_tprduction_comp.pkl'),
-    ("Keyword resonance", r'Files/similarity_tags_keywords.pkl'),
-    ("Cast proximity", r'Files/similarity_tags_tcast.pkl')
+    ("Overall similarity", 'tags'),
+    ("Genre overlap", 'genres'),
+    ("Shared production", 'tprduction_comp'),
+    ("Keyword resonance", 'keywords'),
+    ("Cast proximity", 'tcast')
 ]
 
+# Starting weights of each strategy in the blended ranking; users adjust them with sliders
+BLEND_WEIGHTS = {'tags': 1.0, 'genres': 0.5, 'tprduction_comp': 0.25, 'keywords': 0.5, 'tcast': 0.5}
+
 if 'movie_number' not in st.session_state:
     st.session_state['movie_number'] = 0
 
@@ -32,6 +40,18 @@ if 'user_menu' not in st.session_state:
 if 'recommendations_cache' not in st.session_state:
     st.session_state['recommendations_cache'] = {}
 
+# Identifies this session's background prefetch work, so navigating away can cancel it
+if 'prefetch_owner' not in st.session_state:
+    st.session_state['prefetch_owner'] = uuid.uuid4().hex
+
+
+# Streamlit caching stays in the UI; processing/ is also used without a Streamlit runtime
+@st.cache_data(show_spinner=False, ttl=3600)
+def fetch_posters_batch(movie_ids):
+    # Only runs on a Streamlit cache miss
+    count('streamlit_cache', fn='fetch_posters_batch', result='miss')
+    return preprocess.fetch_posters_batch(movie_ids)
+
 
 def inject_custom_styles():
     st.markdown(
@@ -190,13 +210,18 @@ def main():
             orientation="horizontal",
         )
 
+        # Prefetching for the view being left is no longer useful
+        if st.session_state.get('prefetch_view') != st.session_state.user_menu:
+            prefetcher().cancel(st.session_state.prefetch_owner)
+            st.session_state['prefetch_view'] = st.session_state.user_menu
+
         if st.session_state.user_menu == 'Recommend me a similar movie':
             recommend_display()
 
         elif st.session_state.user_menu == 'Check all Movies':
             paging_movies()
 
-    def gather_recommendations(selected_movie_name):
+    def gather_recommendations(selected_movie_name, weights):
         global displayed
         displayed.clear()
         collected = {}
@@ -205,23 +230,30 @@ def main():
         all_movie_ids = []
         temp_recs = {}
         
-        for descriptor, path in RECOMMENDER_CONFIG:
-            movies_list, movie_ids_list = preprocess.recommend(new_df, selected_movie_name, path)
+        # One pass over all strategies; titles are de-duplicated across tabs
+        results = preprocess.recommend_all(new_df, selected_movie_name,
+                                           [col_name for _, col_name in RECOMMENDER_CONFIG], k_per_strategy=3)
+
+        for descriptor, col_name in RECOMMENDER_CONFIG:
+            movies_list, movie_ids_list = results[col_name]
             recs = []
-            cnt = 0
             for title, movie_id in zip(movies_list, movie_ids_list):
-                if cnt == 3:
-                    break
-                if title not in displayed:
-                    recs.append({"title": title, "poster": None, "movie_id": movie_id})
-                    all_movie_ids.append(movie_id)
-                    displayed.append(title)
-                    cnt += 1
+                recs.append({"title": title, "poster": None, "movie_id": movie_id})
+                all_movie_ids.append(movie_id)
+                displayed.append(title)
             if recs:
                 temp_recs[descriptor] = recs
-        
+
+        # One weighted ranking over every strategy at once
+        if any(weights.values()):
+            titles, movie_ids = preprocess.recommend_hybrid(new_df, selected_movie_name, weights, k=5)
+            temp_recs["Blended picks"] = [{"title": title, "poster": None, "movie_id": movie_id}
+                                          for title, movie_id in zip(titles, movie_ids)]
+            all_movie_ids.extend(movie_ids)
+
         # Batch fetch all posters at once using concurrent requests
-        poster_map = preprocess.fetch_posters_batch(all_movie_ids)
+        with span('fetch_posters_batch', view='recommend'):
+            poster_map = fetch_posters_batch(all_movie_ids)
         
         # Update recommendations with fetched posters
         for descriptor, recs in temp_recs.items():
@@ -229,11 +261,18 @@ def main():
                 if rec['movie_id'] in poster_map:
                     rec['poster'] = poster_map[rec['movie_id']]
             collected[descriptor] = recs
-        
+
+        # Warm the cast of the selected movie and of each strategy's top pick while the user reads
+        lookup = lookup_for(new_df)
+        top_ids = [lookup.movie_ids[lookup.row(selected_movie_name)]]
+        top_ids += [recs[0]['movie_id'] for recs in temp_recs.values()]
+        prefetcher().schedule(st.session_state.prefetch_owner,
+                              [('person', person_id) for person_id in preprocess.top_cast_ids(new_df, top_ids)])
+
         return collected
 
-    def fetch_unique_recommendations(dataset, selected_movie_name, pickle_file_path):
-        movies, posters = preprocess.recommend(dataset, selected_movie_name, pickle_file_path)
+    def fetch_unique_recommendations(dataset, selected_movie_name, col_name):
+        movies, posters = preprocess.recommend(dataset, selected_movie_name, col_name)
         recs = []
         cnt = 0
         for title, poster in zip(movies, posters):
@@ -278,12 +317,16 @@ def main():
             with col2:
                 st.markdown("<br>", unsafe_allow_html=True)
                 rec_button = st.button('Recommend', use_container_width=True)
+            with st.expander("Blend strategies"):
+                weights = {col_name: st.slider(descriptor, 0.0, 1.0, BLEND_WEIGHTS[col_name], 0.05,
+                                               key=f'weight_{col_name}')
+                           for descriptor, col_name in RECOMMENDER_CONFIG}
             st.markdown('</div>', unsafe_allow_html=True)
 
         if rec_button:
             st.session_state.selected_movie_name = selected_movie_name
-            with st.spinner('🎬 Fetching movie recommendations...'):
-                st.session_state.recommendations_cache = gather_recommendations(selected_movie_name)
+            with st.spinner('🎬 Fetching movie recommendations...'), span('recommend_click'):
+                st.session_state.recommendations_cache = gather_recommendations(selected_movie_name, weights)
 
         if st.session_state.recommendations_cache:
             st.markdown("### Explore recommendation strategies")
@@ -302,7 +345,7 @@ def main():
             st.info("Select a movie from the Recommend tab to see rich details here.")
             return
         # movie_id = movies[movies['title'] == selected_movie_name]['movie_id']
-        info = preprocess.get_details(selected_movie_name)
+        info = preprocess.get_details(new_df, selected_movie_name)
 
         with st.container():
             st.text('\n')
@@ -346,18 +389,11 @@ def main():
 
         # Displaying information of casts.
         st.header('Cast')
-        cnt = 0
-        urls = []
-        bio = []
-        cast_names = []
-        for i in info[14]:
-            if cnt == 5:
-                break
-            url, biography= preprocess.fetch_person_details(i)
-            urls.append(url)
-            bio.append(biography)
-            cast_names.append(i)
-            cnt += 1
+        # Up to five cast members fetched together; late ones show a placeholder
+        cast_names = info[14][:5]
+        details = preprocess.fetch_people_details(cast_names)
+        urls = [url for url, _ in details]
+        bio = [biography for _, biography in details]
 
         if not urls:
             st.info("Cast information is unavailable for this title.")
@@ -407,9 +443,14 @@ def main():
     def display_all_movies(start):
         # Fetch posters for current page in batch
         end = min(start + 10, len(movies))
-        movie_ids = [movies['movie_id'][i] for i in range(start, end)]
-        poster_map = preprocess.fetch_posters_batch(movie_ids)
-        
+        lookup = lookup_for(movies)
+        movie_ids = lookup.movie_ids[start:end].tolist()
+        with span('fetch_posters_batch', view='catalog'):
+            poster_map = fetch_posters_batch(movie_ids)
+
+        # Posters of the pages either side are fetched in the background for the next click
+        prefetcher().schedule(st.session_state.prefetch_owner, page_jobs(lookup.movie_ids, start))
+
         i = start
         for _ in range(2):  # two rows of five cards
             cols = st.columns(5)
@@ -417,8 +458,8 @@ def main():
                 if i >= len(movies) or i >= end:
                     break
                 with col:
-                    title = movies['title'][i]
-                    movie_id = movies['movie_id'][i]
+                    title = lookup.titles[i]
+                    movie_id = lookup.movie_ids[i]
                     poster = poster_map.get(movie_id)
                     # Only show image if it's a valid TMDB poster
                     if poster and 'image.tmdb.org' in poster:
@@ -430,10 +471,25 @@ def main():
 
         st.session_state['page_number'] = i
 
-    with Main() as bot:
-        bot.main_()
-        new_df, movies, movies2 = bot.getter()
-        initial_options()
+    def debug_sidebar():
+        # Timings of this process, for finding where a slow page goes
+        with st.sidebar:
+            st.markdown('<div class="section-title">Debug metrics</div>', unsafe_allow_html=True)
+            st.dataframe(span_summary(), use_container_width=True, hide_index=True)
+            with st.expander("Prometheus dump"):
+                st.code(prometheus_text(), language=None)
+            if st.button("Reset metrics"):
+                registry.reset()
+
+    start_file_writer()
+
+    # Loaded once per process and shared by all sessions; newer builds on disk are swapped in
+    with span('current_artifacts'):
+        artifacts = current_artifacts()
+    new_df, movies, movies2 = artifacts.new_df, artifacts.movies, artifacts.movies2
+    initial_options()
+    if METRICS_SIDEBAR:
+        debug_sidebar()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,250 @@
+"""
+Approximate nearest neighbours by random-projection LSH.
+
+    python -m processing.ann --tables 32 --min-recall 0.9
+
+Each movie's L2-normalised feature vector is hashed by the signs of its projections
+on random hyperplanes, `bits` planes per table and `tables` independent tables.
+Movies with a high cosine share buckets with high probability, so a query only
+scores the movies in its own buckets (plus `probes` neighbouring buckets per table,
+flipping the least certain bits) and ranks them exactly. A query whose buckets hold
+too much of the catalog to save time (long texts of common words, such as tags) is
+scored exactly instead. The build is linear in the catalog size, unlike the
+all-pairs neighbour index.
+
+Each strategy's index is tuned at build time: starting from about 8 movies per
+bucket, the hyperplanes per table are lowered (widening the buckets) until recall@25
+against exact search reaches ANN_MIN_RECALL on a sample. A strategy whose queries
+would then mostly be scored exactly anyway (long texts of common words, such as
+tags, or any strategy of a small catalog) gets no index and is served exactly. Run
+as a module it tunes every strategy of the current artifacts and reports the bits
+chosen, recall, the share of the catalog scored and latency against exact search.
+"""
+import argparse
+import math
+import os
+import time
+import numpy as np
+from processing.similarity import STRATEGIES, query_scores, settle, top_k_indices
+from processing.store import artifact_path, load_arrays, load_csr, load_meta, save_arrays
+
+# Hash tables, and the most hyperplanes per table tried (None picks it from the catalog size)
+ANN_TABLES = int(os.environ.get('CINESCOPE_ANN_TABLES', 32))
+ANN_BITS = int(os.environ['CINESCOPE_ANN_BITS']) if os.environ.get('CINESCOPE_ANN_BITS') else None
+
+# Extra buckets visited per table at query time; more probes, higher recall and latency
+ANN_PROBES = int(os.environ.get('CINESCOPE_ANN_PROBES', 2))
+
+# Share of the catalog in the buckets past which a query scores every movie exactly, which is then faster
+ANN_EXACT_SHARE = float(os.environ.get('CINESCOPE_ANN_EXACT_SHARE', 0.25))
+
+# Recall@25 against exact search each strategy's index must reach on a sample of movies
+ANN_MIN_RECALL = float(os.environ.get('CINESCOPE_ANN_MIN_RECALL', 0.9))
+
+# Share of sampled queries scored exactly past which a strategy gets no index at all
+ANN_SKIP_EXACT = 0.5
+
+ANN_SEED = 0
+
+
+def auto_bits(n):
+    # About 8 movies per bucket (9 bits at 3k, 13 at 50k, 16 at 500k), so a query scores a small share of the catalog
+    return int(min(30, max(8, round(math.log2(max(n, 2))) - 3)))
+
+
+def _hash(projections, tables, bits):
+    # Sign bits of each table's projections packed into one integer per table
+    signs = (projections > 0).reshape(len(projections), tables, bits)
+    return (signs * (1 << np.arange(bits, dtype=np.uint32))).sum(axis=2, dtype=np.uint32)
+
+
+class LSHIndex():
+    """
+    Per-table bucket codes sorted once, so a bucket is a searchsorted range of `order`.
+    `planes` is (terms, tables * bits); `codes` and `order` are (tables, movies).
+    """
+
+    def __init__(self, planes, codes, order):
+        # Plain views of the memory maps: slicing a memmap costs more than a small search
+        self.planes = np.asarray(planes)
+        self.codes = np.asarray(codes)
+        self.order = np.asarray(order)
+        self.tables = codes.shape[0]
+        self.bits = planes.shape[1] // self.tables
+
+    def __len__(self):
+        return self.codes.shape[1]
+
+    def candidates(self, vector, probes=ANN_PROBES):
+        # Rows sharing a bucket with `vector` (1 x terms) in any table, or a probed neighbour bucket
+        return self._buckets(np.asarray(vector @ self.planes, dtype=np.float32).ravel(), probes)
+
+    def _buckets(self, projections, probes):
+        base = _hash(projections.reshape(1, -1), self.tables, self.bits)[0]
+        flips = np.argsort(np.abs(projections).reshape(self.tables, self.bits), axis=1)[:, :probes]
+        probe_codes = np.hstack([base[:, None], base[:, None] ^ (np.uint32(1) << flips.astype(np.uint32))])
+
+        # A bucket ends where the next code would start, so one search per table finds both ends
+        n, width = len(self), probe_codes.shape[1]
+        keys = np.hstack([probe_codes, probe_codes + np.uint32(1)])
+        bounds = np.empty((self.tables, 2 * width), dtype=np.int64)
+        for table in range(self.tables):
+            bounds[table] = self.codes[table].searchsorted(keys[table])
+        starts = bounds[:, :width] + np.arange(self.tables)[:, None] * n
+
+        # Buckets overlap across tables, so rows are marked in a mask rather than sorted and deduplicated
+        found = np.zeros(n, dtype=bool)
+        found[self.order.reshape(-1)[_ranges(starts.ravel(), (bounds[:, width:] - bounds[:, :width]).ravel())]] = True
+        return np.flatnonzero(found)
+
+    def query(self, features, row, k, exclude=(), probes=ANN_PROBES):
+        """
+        Rows of the k best candidates for `row`, ranked by exact cosine. May return
+        fewer than k when the buckets hold too few movies. When the buckets hold more
+        than ANN_EXACT_SHARE of the catalog, every movie is scored exactly instead.
+        """
+        # Read straight from the CSR arrays; scipy's row indexing costs more than the rest of a small query
+        terms = features.indices[features.indptr[row]:features.indptr[row + 1]]
+        weights = features.data[features.indptr[row]:features.indptr[row + 1]]
+        candidates = self._buckets(weights @ self.planes[terms], probes)
+        if len(candidates) > ANN_EXACT_SHARE * len(self):
+            return top_k_indices(query_scores(features, row), k, exclude=exclude)
+
+        vector = np.zeros(features.shape[1], dtype=np.float32)
+        vector[terms] = weights
+        starts = features.indptr[candidates]
+        lengths = features.indptr[candidates + 1] - starts
+        positions = _ranges(starts, lengths)
+        products = features.data[positions] * vector[features.indices[positions]]
+        scores = settle(np.bincount(np.repeat(np.arange(len(candidates)), lengths), weights=products,
+                                    minlength=len(candidates)))
+        skip = np.flatnonzero(np.isin(candidates, np.fromiter(exclude, dtype=np.int64)))
+        return candidates[top_k_indices(scores, k, exclude=skip)]
+
+
+def _ranges(starts, lengths):
+    # Concatenated arange(start, start + length) of every pair, without a Python loop
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+def build_index(features, tables=ANN_TABLES, bits=ANN_BITS, seed=ANN_SEED, block_size=65536):
+    """
+    Hash every row of a feature matrix. Rows are projected in blocks, so the dense
+    projections never exceed block_size x (tables * bits) floats.
+    """
+    n, terms = features.shape
+    bits = bits or auto_bits(n)
+    planes = np.random.default_rng(seed).standard_normal((terms, tables * bits), dtype=np.float32)
+
+    codes = np.empty((tables, n), dtype=np.uint32)
+    for start in range(0, n, block_size):
+        block = np.asarray(features[start:start + block_size] @ planes)
+        codes[:, start:start + block_size] = _hash(block, tables, bits).T
+
+    order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+    return LSHIndex(planes, np.take_along_axis(codes, order, axis=1), order)
+
+
+def update_index(index, features, rows):
+    """
+    Re-hash `rows` of a changed feature matrix into the index; rows past its end are
+    new movies and must be included. Other rows keep their codes, so only the
+    buckets are re-sorted. The features must keep the columns the planes were made for.
+    """
+    n = features.shape[0]
+    codes = np.empty((index.tables, n), dtype=np.uint32)
+    np.put_along_axis(codes[:, :len(index)], np.asarray(index.order, dtype=np.int64), index.codes, axis=1)
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows):
+        codes[:, rows] = _hash(np.asarray(features[rows] @ index.planes), index.tables, index.bits).T
+
+    order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+    return LSHIndex(index.planes, np.take_along_axis(codes, order, axis=1), order)
+
+
+def tune_index(features, tables=ANN_TABLES, bits=ANN_BITS, min_recall=ANN_MIN_RECALL, probes=ANN_PROBES):
+    """
+    Index of `features` reaching min_recall, lowering the hyperplanes per table from
+    `bits` (by catalog size unless given) until it does. Returns (index, stats) with
+    the evaluate() stats and the bits chosen; index is None when more than
+    ANN_SKIP_EXACT of the queries would be scored exactly, so none is worth storing.
+    """
+    bits = bits or auto_bits(features.shape[0])
+    while True:
+        index = build_index(features, tables, bits)
+        stats = dict(evaluate(features, index, probes=probes), bits=bits)
+        if stats['exact'] > ANN_SKIP_EXACT:
+            return None, stats
+        if stats['recall'] >= min_recall or bits == 1:
+            return index, stats
+        bits -= 1
+
+
+def save_index(path, index, stats=None, skipped=None):
+    # A skipped strategy keeps only its stats, so the build is not retried on every start
+    if index is None:
+        save_arrays(path, meta={'stats': stats, 'skipped': skipped})
+    else:
+        save_arrays(path, meta={'tables': index.tables, 'bits': index.bits, 'stats': stats},
+                    planes=index.planes, codes=index.codes, order=index.order)
+
+
+def load_index(path):
+    # None when the build left the strategy to exact scoring
+    if load_meta(path).get('skipped'):
+        return None
+    return LSHIndex(*load_arrays(path, 'planes', 'codes', 'order'))
+
+
+def evaluate(features, index, k=25, sample=200, probes=ANN_PROBES, seed=ANN_SEED):
+    """
+    Recall@k of the index against the exact ranking over a random sample of movies.
+    An approximate pick tied with the exact k-th score counts as a hit. `candidates`
+    is the mean share of the catalog in a query's buckets and `exact` the share of
+    queries that fell back to exact scoring.
+    """
+    n = features.shape[0]
+    rows = np.random.default_rng(seed).choice(n, size=min(sample, n), replace=False)
+    hits = candidates = fallbacks = 0
+    ann_time = exact_time = 0.0
+    for row in rows:
+        started = time.perf_counter()
+        picks = index.query(features, row, k, exclude=(row,), probes=probes)
+        ann_time += time.perf_counter() - started
+        found = len(index.candidates(features[row], probes))
+        candidates += found
+        fallbacks += found > ANN_EXACT_SHARE * n
+
+        started = time.perf_counter()
+        scores = query_scores(features, row)
+        exact = top_k_indices(scores, k, exclude=(row,))
+        exact_time += time.perf_counter() - started
+
+        if len(exact):
+            hits += int((scores[picks] >= scores[exact[-1]]).sum())
+    wanted = len(rows) * min(k, n - 1)
+    return {'recall': hits / max(wanted, 1), 'candidates': candidates / len(rows) / n, 'exact': fallbacks / len(rows),
+            'ann_ms': 1000 * ann_time / len(rows), 'exact_ms': 1000 * exact_time / len(rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the LSH index of every strategy against exact search.')
+    parser.add_argument('--tables', type=int, default=ANN_TABLES)
+    parser.add_argument('--bits', type=int, default=ANN_BITS, help='most hyperplanes per table (default: by catalog size)')
+    parser.add_argument('--probes', type=int, default=ANN_PROBES)
+    parser.add_argument('--min-recall', type=float, default=ANN_MIN_RECALL)
+    args = parser.parse_args()
+
+    for col_name in STRATEGIES:
+        features = load_csr(artifact_path(f'features_{col_name}'))
+        started = time.perf_counter()
+        index, stats = tune_index(features, args.tables, args.bits, args.min_recall, args.probes)
+        tune_time = time.perf_counter() - started
+        print(f"{col_name}: {args.tables}x{stats['bits']} bits, recall@25 {stats['recall']:.3f}, "
+              f"{stats['candidates']:.1%} of the catalog scored, {stats['exact']:.0%} of queries exact, "
+              f"{stats['ann_ms']:.2f} ms vs {stats['exact_ms']:.2f} ms exact, tuned in {tune_time:.1f}s"
+              f"{'' if index is not None else ' (skipped: served exactly)'}")
+
+
+if __name__ == '__main__':
+    main()
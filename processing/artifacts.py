@@ -0,0 +1,185 @@
+import threading
+import time
+import weakref
+from processing.ann import load_index
+from processing.build import build_lock, fresh_artifacts, read_build_id
+from processing.embedding import load_embedding
+from processing.metrics import span
+from processing.similarity import STRATEGIES, stack_features
+from processing.store import artifact_path, load_arrays, load_csr, load_frame
+
+# Columns of the movies frame read by the details page
+DETAIL_COLUMNS = ['movie_id', 'title', 'genres', 'cast', 'top_cast', 'director']
+
+# How often (seconds) the build id on disk is checked for a newer build
+ARTIFACT_CHECK_INTERVAL = 5.0
+
+
+def disk_signature():
+    # Builds replace artifacts one directory at a time and write a new id once all are in place,
+    # so a snapshot is keyed on the id, and None means a build is still being written
+    return read_build_id()
+
+
+class Artifacts():
+    """
+    One immutable, fully opened set of serving artifacts. Arrays are memory-mapped when the
+    snapshot is created, so a later rebuild on disk never changes a snapshot in use.
+    Neighbour, LSH and embedding artifacts are opened only when named in `fresh`; others
+    on disk may be left from another mode or an older catalog.
+    """
+
+    def __init__(self, new_df, movies, movies2, signature, fresh):
+        self.new_df = new_df
+        self.movies = movies
+        self.movies2 = movies2
+        self.signature = signature
+
+        self._neighbors = {}
+        self._features = {}
+        self._ann = {}
+        self._embeddings = {}
+        for col_name in STRATEGIES:
+            neighbors_path = artifact_path(f'neighbors_{col_name}')
+            if f'neighbors_{col_name}' in fresh:
+                self._neighbors[col_name] = load_arrays(neighbors_path, 'indices', 'scores')
+            ann_path = artifact_path(f'ann_{col_name}')
+            if f'ann_{col_name}' in fresh:
+                # None when the build skipped it; such strategies are scored exactly
+                index = load_index(ann_path)
+                if index is not None:
+                    self._ann[col_name] = index
+            embedding_path = artifact_path(f'embedding_{col_name}')
+            if f'embedding_{col_name}' in fresh:
+                # Zero-width when the build skipped it; such strategies are scored exactly
+                vectors = load_embedding(embedding_path)[0]
+                if vectors.shape[1]:
+                    self._embeddings[col_name] = vectors
+            self._features[col_name] = load_csr(artifact_path(f'features_{col_name}'))
+
+        # A last check that every array describes the same catalog rows
+        for col_name in STRATEGIES:
+            arrays = [self._features[col_name]] + list(self._neighbors.get(col_name, ()))
+            if col_name in self._embeddings:
+                arrays.append(self._embeddings[col_name])
+            lengths = [array.shape[0] for array in arrays]
+            if col_name in self._ann:
+                lengths.append(len(self._ann[col_name]))
+            if any(length != len(new_df) for length in lengths):
+                raise ValueError(f'artifacts for {col_name} do not match the {len(new_df)} catalog rows')
+
+        # Opened with everything else, so the details page can never read a later build
+        self._detail_frames = (load_frame(artifact_path('movies'), DETAIL_COLUMNS),
+                               load_frame(artifact_path('movies2')))
+        if any(len(frame) != len(movies) for frame in self._detail_frames):
+            raise ValueError(f'detail frames do not match the {len(movies)} catalog movies')
+        self._hybrid = None
+
+    def neighbors(self, col_name):
+        return self._neighbors[col_name]
+
+    def features(self, col_name):
+        return self._features[col_name]
+
+    def ann(self, col_name):
+        # None when no LSH index has been built for this strategy
+        return self._ann.get(col_name)
+
+    def embedding(self, col_name):
+        # None when no SVD embedding has been built for this strategy
+        return self._embeddings.get(col_name)
+
+    def hybrid_features(self):
+        # Every strategy's features in one matrix, built on first use of the blended ranking
+        if self._hybrid is None:
+            self._hybrid = stack_features([self._features[col_name] for col_name in STRATEGIES])
+        return self._hybrid
+
+    def detail_frames(self):
+        # Columns only the details page needs, from the same build as the rest of the snapshot
+        return self._detail_frames
+
+
+class ArtifactManager():
+    """
+    Process-wide holder of the current Artifacts snapshot. The first call builds or loads
+    the artifacts; later calls return the same snapshot and at most every
+    ARTIFACT_CHECK_INTERVAL seconds read the build id to hot-swap in a newer complete build.
+    """
+
+    def __init__(self, check_interval=ARTIFACT_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current = None
+        self._last_check = 0.0
+
+    def get(self):
+        current = self._current
+        if current is not None and time.monotonic() - self._last_check < self.check_interval:
+            return current
+
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._last_check < self.check_interval:
+                return self._current
+
+            signature = disk_signature()
+            if self._current is None:
+                self._swap(self._load(build=True))
+            elif signature is not None and signature != self._current.signature:
+                try:
+                    self._swap(self._load())
+                except (OSError, ValueError):
+                    # Still being written; keep serving the current snapshot and retry later
+                    pass
+            self._last_check = time.monotonic()
+            return self._current
+
+    def reload(self):
+        # Force a reload regardless of the check interval, e.g. right after a rebuild
+        with self._lock:
+            self._swap(self._load())
+            self._last_check = time.monotonic()
+            return self._current
+
+    def _load(self, build=False):
+        from processing.display import CATALOG_COLUMNS, Main
+
+        with span('artifact_load', first=build):
+            if build:
+                # First load of the process: missing artifacts are built from the CSVs
+                with Main() as bot:
+                    bot.main_()
+            # Opened under the shared build lock, so no build replaces files meanwhile. A hot-swap
+            # does not wait for a running build; the next check retries
+            with build_lock(shared=True, blocking=build):
+                signature = disk_signature()
+                if signature is None and not build:
+                    raise FileNotFoundError('a build is being written')
+                new_df, movies, movies2 = (load_frame(artifact_path(name), CATALOG_COLUMNS)
+                                           for name in ('new_df', 'movies', 'movies2'))
+                return Artifacts(new_df, movies, movies2, signature, fresh_artifacts())
+
+    def _swap(self, artifacts):
+        # A single reference assignment, so readers see either the old or the new snapshot
+        _snapshots[id(artifacts.new_df)] = artifacts
+        weakref.finalize(artifacts.new_df, _snapshots.pop, id(artifacts.new_df), None)
+        self._current = artifacts
+
+
+_manager = ArtifactManager()
+
+# Snapshot that owns each live new_df, so a request keeps using one consistent set
+_snapshots = {}
+
+
+def current_artifacts():
+    return _manager.get()
+
+
+def reload_artifacts():
+    return _manager.reload()
+
+
+def artifacts_for(new_df):
+    artifacts = _snapshots.get(id(new_df))
+    return artifacts if artifacts is not None else current_artifacts()
@@ -0,0 +1,236 @@
+"""
+Content-addressed artifact builds.
+
+Every artifact under Files/ is recorded in Files/manifest.json with a key. The key
+hashes everything the artifact is derived from: the input CSVs, the pipeline
+parameters (cast depth, stopwords, max_features, K) and the source of the code that
+builds it. An artifact is rebuilt only when its key changes, and the independent
+per-strategy artifacts are built concurrently in a process pool. A build holds an
+exclusive lock on Files/.build.lock, so processes starting together on stale inputs
+build once: the others wait, re-read the manifest and find the artifacts fresh.
+"""
+import hashlib
+import inspect
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import sklearn
+from processing import ann, embedding, parsing, similarity, text
+from processing.ann import ANN_BITS, ANN_MIN_RECALL, ANN_PROBES, ANN_SEED, ANN_TABLES, save_index, tune_index
+from processing.embedding import EMBEDDING_DIM, EMBEDDING_MIN_AGREEMENT, EMBEDDING_SEED, build_embedding, \
+    embedding_bytes, ranking_agreement, save_embedding, skip_reason, skipped_embedding, sparse_bytes
+from processing.similarity import MAX_FEATURES, NEIGHBOR_K, SCORE_DECIMALS, STRATEGIES, blocked_neighbors, \
+    build_features
+from processing.store import ARTIFACT_DIR, artifact_path, load_csr, load_frame, save_arrays, save_csr
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: builds are not locked across processes
+    fcntl = None
+
+MANIFEST_PATH = artifact_path('manifest.json')
+
+# Written last by every build, so its content names a complete set of artifacts
+BUILD_ID_PATH = artifact_path('build_id')
+
+# Held exclusively by a build and shared while a snapshot is opened, across every process on the host
+BUILD_LOCK_PATH = artifact_path('.build.lock')
+
+SOURCE_CSVS = [r'Files/tmdb_5000_movies.csv', r'Files/tmdb_5000_credits.csv']
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _source_digest(*modules):
+    sha = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as source:
+            sha.update(source.read())
+    return sha.hexdigest()
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {'inputs': {}, 'artifacts': {}}
+
+
+def save_manifest(manifest):
+    tmp_path = f'{MANIFEST_PATH}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+@contextmanager
+def build_lock(shared=False, blocking=True):
+    """
+    Hold the build lock for the block. Without blocking, BlockingIOError is raised at
+    once when another process holds it in a conflicting mode. Not reentrant: a process
+    must not take it again while holding it.
+    """
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    with open(BUILD_LOCK_PATH, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        # Closing the file releases the lock
+        yield
+
+
+def start_build():
+    # Removed before a build writes anything; until finish_build() no snapshot opens the half-written set
+    try:
+        os.remove(BUILD_ID_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def finish_build():
+    tmp_path = f'{BUILD_ID_PATH}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as build_id_file:
+        build_id_file.write(uuid.uuid4().hex)
+    os.replace(tmp_path, BUILD_ID_PATH)
+
+
+def read_build_id():
+    # None while a build is in progress (or one was interrupted)
+    try:
+        with open(BUILD_ID_PATH) as build_id_file:
+            return build_id_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def file_digest(path, manifest):
+    # Re-hashing a large CSV is skipped while its size and mtime are unchanged
+    stat = os.stat(path)
+    known = manifest['inputs'].get(path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    digest = sha256_file(path)
+    manifest['inputs'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def artifact_keys(manifest, csv_paths=SOURCE_CSVS):
+    """
+    Key of every artifact for the current inputs, parameters and code. Keys chain, so
+    a new CSV invalidates the frames and, through them, every feature and neighbour set.
+    """
+    # Imported here so worker processes never load the Streamlit-facing module
+    from processing import preprocess
+
+    stop_words = sorted(text.Normaliser().stop_words)
+    frames = _digest('frames', [file_digest(path, manifest) for path in csv_paths], parsing.CAST_DEPTH, stop_words,
+                     inspect.getsource(preprocess.read_csv_to_df), _source_digest(parsing, text))
+    keys = {'movies': frames, 'movies2': frames, 'new_df': frames}
+
+    code = _source_digest(similarity)
+    for col_name in STRATEGIES:
+        features = _digest('features', frames, col_name, MAX_FEATURES, 'english', sklearn.__version__, code)
+        keys[f'features_{col_name}'] = features
+        keys[f'neighbors_{col_name}'] = _digest('neighbors', features, NEIGHBOR_K, SCORE_DECIMALS, code)
+        keys[f'ann_{col_name}'] = _digest('ann', features, ANN_TABLES, ANN_BITS, ANN_MIN_RECALL, ANN_PROBES,
+                                          ANN_SEED, _source_digest(ann))
+        keys[f'embedding_{col_name}'] = _digest('embedding', features, EMBEDDING_DIM, EMBEDDING_MIN_AGREEMENT,
+                                                EMBEDDING_SEED, sklearn.__version__, _source_digest(embedding))
+    return keys
+
+
+def incremental_key(previous_key, *delta_paths):
+    # Key of an artifact updated in place from delta CSVs, chained from the key it had before
+    return _digest('incremental', previous_key, [sha256_file(path) for path in delta_paths])
+
+
+def is_fresh(manifest, keys, name):
+    """
+    Whether the stored artifact may be served for the current keys: it was built for
+    them, or it was updated incrementally (under its own key, recorded in
+    manifest['incremental']) from a build of inputs that now hash to them.
+    """
+    if not os.path.exists(artifact_path(name)):
+        return False
+    recorded = manifest['artifacts'].get(name)
+    incremental = manifest.get('incremental', {}).get(name)
+    if incremental is not None and recorded == incremental['key']:
+        return incremental['inputs'] == keys[name]
+    return recorded == keys[name]
+
+
+def fresh_artifacts():
+    # Names of the stored artifacts that may be served for the current inputs, parameters and code
+    manifest = load_manifest()
+    keys = artifact_keys(manifest)
+    return {name for name in keys if is_fresh(manifest, keys, name)}
+
+
+def build_strategy(col_name, features=True, neighbors=True, lsh=False, embed=False):
+    """
+    Build the feature matrix, neighbour index, LSH index and/or SVD embedding of one
+    strategy from the stored new_df frame. Runs in a worker process, so it only touches files.
+    """
+    features_path = artifact_path(f'features_{col_name}')
+    if features:
+        texts = load_frame(artifact_path('new_df'), [col_name])[col_name]
+        # Bag of words kept sparse (CSR) and L2-normalised, so the product of rows is the cosine similarity
+        vec_tags, vocabulary = build_features(texts)
+        # The vocabulary is kept so incremental updates can transform new rows consistently
+        save_csr(features_path, vec_tags, meta={'vocabulary': vocabulary})
+    else:
+        vec_tags = load_csr(features_path)
+
+    if neighbors:
+        # Only the top-K neighbours of each movie are kept, and the N x N matrix is never formed whole
+        indices, scores = blocked_neighbors(vec_tags)
+        save_arrays(artifact_path(f'neighbors_{col_name}'), indices=indices, scores=scores)
+
+    if lsh:
+        # Linear in the catalog size, for catalogs where the all-pairs index is out of reach
+        index, stats = tune_index(vec_tags)
+        skipped = None if index is not None else f"{stats['exact']:.0%} of queries would be scored exactly"
+        save_index(artifact_path(f'ann_{col_name}'), index, stats, skipped)
+
+    if embed:
+        vectors, components = build_embedding(vec_tags)
+        size, exact_size = embedding_bytes(vectors, components), sparse_bytes(vec_tags)
+        # Agreement costs a few hundred exact queries, so it is only measured for an embedding small enough to keep
+        agreement = ranking_agreement(vec_tags, vectors) if size < exact_size else None
+        skipped = skip_reason(size, exact_size, agreement)
+        if skipped is None:
+            # Stored with the artifact so the fidelity traded for size is on record
+            save_embedding(artifact_path(f'embedding_{col_name}'), vectors, components, agreement)
+        else:
+            save_embedding(artifact_path(f'embedding_{col_name}'), *skipped_embedding(vec_tags), agreement,
+                           skipped=skipped)
+    return col_name
+
+
+def build_strategies(jobs, workers=None):
+    """
+    Run build_strategy for every (col_name, features, neighbors, lsh, embed) job. Strategies are
+    independent, so several jobs are spread over a process pool.
+    """
+    if len(jobs) <= 1 or workers == 1:
+        return [build_strategy(*job) for job in jobs]
+
+    workers = min(len(jobs), workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as executor:
+        futures = [executor.submit(build_strategy, *job) for job in jobs]
+        return [future.result() for future in futures]
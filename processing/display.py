@@ -1,9 +1,15 @@
-import os
+import logging
 from processing import preprocess
-import pickle
-import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from processing.build import artifact_keys, build_lock, build_strategies, build_strategy, finish_build, is_fresh, \
+    load_manifest, read_build_id, save_manifest, start_build
+from processing.store import artifact_path, load_csr, load_frame, load_meta, save_frame
+from processing.similarity import RECOMMEND_MODE, STRATEGIES, sparse_similarity
+
+logger = logging.getLogger(__name__)
+
+# Columns every page needs; everything else is loaded lazily from the columnar artifacts
+CATALOG_COLUMNS = ['movie_id', 'title']
+
 
 class Main():
 
@@ -15,94 +21,144 @@ class Main():
         # Cleanup code, if needed
         pass
 
-    def __init__(self):
+    def __init__(self, rebuild=False):
+        # rebuild=True recomputes every artifact from the CSVs even if it is up to date
+        self.rebuild = rebuild
         self.new_df = None
         self.movies = None
         self.movies2 = None
+        self.manifest = None
+        self.keys = None
+        self.writing = False
 
     def getter(self):
         return self.new_df, self.movies, self.movies2
 
-    def get_df(self):
-        pickle_file_path = r'Files/new_df_dict.pkl'
-
-        # Checking if preprocessed dataframe already exists or not
-        if os.path.exists(pickle_file_path):
-
-            # Read the Pickle file and load the dictionary -- 3 times
-            # For the movies dataframe
-            pickle_file_path = r'Files/movies_dict.pkl'
-            with open(pickle_file_path, 'rb') as pickle_file:
-                loaded_dict = pickle.load(pickle_file)
-
-            self.movies = pd.DataFrame.from_dict(loaded_dict)
-
-            # Now, for the movies2 doing the same work
-            pickle_file_path = r'Files/movies2_dict.pkl'
-            with open(pickle_file_path, 'rb') as pickle_file:
-                loaded_dict_2 = pickle.load(pickle_file)
-
-            self.movies2 = pd.DataFrame.from_dict(loaded_dict_2)
+    def is_fresh(self, name):
+        # Up to date when the manifest key matches the current inputs, parameters and code
+        if self.manifest is None:
+            self.manifest = load_manifest()
+            self.keys = artifact_keys(self.manifest)
+        return not self.rebuild and is_fresh(self.manifest, self.keys, name)
+
+    def begin_writing(self):
+        # Before the first artifact is replaced, so snapshots stop opening the set until the build finishes
+        if not self.writing:
+            start_build()
+            self.writing = True
+
+    def record(self, *names):
+        incremental = self.manifest.get('incremental', {})
+        if any(name in incremental for name in names):
+            # Incremental updates build on one another, so once one is rebuilt in full the rest are stale.
+            # Only their keys are dropped: snapshots skip stale artifacts and the next build replaces them
+            for name in incremental:
+                self.manifest['artifacts'].pop(name, None)
+            incremental.clear()
+        for name in names:
+            self.manifest['artifacts'][name] = self.keys[name]
+        save_manifest(self.manifest)
 
-            # Now, For new_df
-            pickle_file_path = r'Files/new_df_dict.pkl'
-            with open(pickle_file_path, 'rb') as pickle_file:
-                loaded_dict = pickle.load(pickle_file)
+    def get_df(self):
+        # Checking if preprocessed dataframes already exist and are up to date
+        if all(self.is_fresh(name) for name in ('movies', 'movies2', 'new_df')):
 
-            self.new_df = pd.DataFrame.from_dict(loaded_dict)
+            # Columnar artifacts: the pages only need movie_id and title up front,
+            # the other columns are read on demand
+            self.movies = load_frame(artifact_path('movies'), CATALOG_COLUMNS)
+            self.movies2 = load_frame(artifact_path('movies2'), CATALOG_COLUMNS)
+            self.new_df = load_frame(artifact_path('new_df'), CATALOG_COLUMNS)
 
         else:
+            self.begin_writing()
             self.movies, self.new_df, self.movies2 = preprocess.read_csv_to_df()
 
-            # Converting to pickle file (dumping file)
-            # Convert the DataFrame to a dictionary
-
-            #  Now, doing for the movies dataframw
-            movies_dict = self.movies.to_dict()
-
-            pickle_file_path = r'Files/movies_dict.pkl'
-            with open(pickle_file_path, 'wb') as pickle_file:
-                pickle.dump(movies_dict, pickle_file)
-
-            #  Now, doing for the movies2 dataframe
-            movies2_dict = self.movies2.to_dict()
-
-            pickle_file_path = r'Files/movies2_dict.pkl'
-            with open(pickle_file_path, 'wb') as pickle_file:
-                pickle.dump(movies2_dict, pickle_file)
+            # Rows are positional from here on, matching the stored artifacts
+            self.movies = self.movies.reset_index(drop=True)
+            self.movies2 = self.movies2.reset_index(drop=True)
+            self.new_df = self.new_df.reset_index(drop=True)
 
-            # For the new_df
-            df_dict = self.new_df.to_dict()
+            save_frame(artifact_path('movies'), self.movies)
+            save_frame(artifact_path('movies2'), self.movies2)
+            save_frame(artifact_path('new_df'), self.new_df)
+            self.record('movies', 'movies2', 'new_df')
 
-            # Save the dictionary to a Pickle file
-            pickle_file_path = r'Files/new_df_dict.pkl'
-            with open(pickle_file_path, 'wb') as pickle_file:
-                pickle.dump(df_dict, pickle_file)
+    def get_features(self, col_name):
+        if not self.is_fresh(f'features_{col_name}'):
+            self.begin_writing()
+            build_strategy(col_name, features=True, neighbors=False)
+            self.record(f'features_{col_name}')
+        return load_csr(artifact_path(f'features_{col_name}'))
 
     def vectorise(self, col_name):
-        # Model to vectorise the words using CountVectorizer (Bag of words)
-        cv = CountVectorizer(max_features=5000, stop_words='english')
-        vec_tags = cv.fit_transform(self.new_df[col_name]).toarray()
-        sim_bt = cosine_similarity(vec_tags)
+        # The full N x N similarity, for inspecting small catalogs; builds only keep blocked top-K rows
+        sim_bt = sparse_similarity(self.get_features(col_name))
         return sim_bt
 
-    def get_similarity(self, col_name):
-        pickle_file_path = fr'Files/similarity_tags_{col_name}.pkl'
-        if os.path.exists(pickle_file_path):
-            pass
-        else:
-            similarity_tags = self.vectorise(col_name)
-
-            # Converting to pickle file (dumping file)
-            # Save the dictionary to a Pickle file
-            with open(pickle_file_path, 'wb') as pickle_file:
-                pickle.dump(similarity_tags, pickle_file)
+    def get_neighbors(self, col_name):
+        if not self.is_fresh(f'neighbors_{col_name}'):
+            self.get_features(col_name)
+            self.begin_writing()
+            build_strategy(col_name, features=False, neighbors=True)
+            self.record(f'neighbors_{col_name}')
 
     def main_(self):
-        # This is to make sure that resources are available.
+        # This is to make sure that resources are available and match the current inputs.
+        # Processes starting together build one at a time; those that waited re-read the manifest
+        # and find the artifacts fresh
+        with build_lock():
+            self.manifest = None
+            self._build_stale()
+
+    def _build_stale(self):
+        # Outside neighbors mode similarities are computed per request, nothing quadratic is stored
+        with_neighbors = RECOMMEND_MODE not in ('query', 'ann', 'embedding')
+        kinds = ['features']
+        if with_neighbors:
+            kinds.append('neighbors')
+        elif RECOMMEND_MODE in ('ann', 'embedding'):
+            kinds.append(RECOMMEND_MODE)
+        needed = ['movies', 'movies2', 'new_df'] + [f'{kind}_{col_name}' for kind in kinds for col_name in STRATEGIES]
+        stale = [name for name in needed if not self.is_fresh(name)]
+        if any(name in self.manifest.get('incremental', {}) for name in needed) and stale:
+            # Incrementally updated artifacts only match each other, so one stale among them rebuilds them all
+            logger.info('Rebuilding every incrementally updated artifact, as %s is stale', ', '.join(stale))
+            self.rebuild = True
+
         self.get_df()
-        self.get_similarity('tags')
-        self.get_similarity('genres')
-        self.get_similarity('keywords')
-        self.get_similarity('tcast')
-        self.get_similarity('tprduction_comp')
\ No newline at end of file
+
+        jobs = []
+        for col_name in STRATEGIES:
+            features = not self.is_fresh(f'features_{col_name}')
+            neighbors = with_neighbors and (features or not self.is_fresh(f'neighbors_{col_name}'))
+            lsh = RECOMMEND_MODE == 'ann' and (features or not self.is_fresh(f'ann_{col_name}'))
+            embed = RECOMMEND_MODE == 'embedding' and (features or not self.is_fresh(f'embedding_{col_name}'))
+            if features or neighbors or lsh or embed:
+                jobs.append((col_name, features, neighbors, lsh, embed))
+
+        # Stale strategies are independent of each other and built concurrently
+        if jobs:
+            self.begin_writing()
+        build_strategies(jobs)
+        for col_name, *built in jobs:
+            names = [f'features_{col_name}', f'neighbors_{col_name}', f'ann_{col_name}', f'embedding_{col_name}']
+            self.record(*(name for name, done in zip(names, built) if done))
+            if built[2]:
+                meta = load_meta(artifact_path(f'ann_{col_name}'))
+                if meta.get('skipped'):
+                    logger.info('%s LSH index skipped, served exactly instead: %s', col_name, meta['skipped'])
+                else:
+                    logger.info('%s LSH index: %d bits, recall@25 %.3f, %.1f%% of the catalog scored', col_name,
+                                meta['bits'], meta['stats']['recall'], 100 * meta['stats']['candidates'])
+            if built[3]:
+                meta = load_meta(artifact_path(f'embedding_{col_name}'))
+                if meta.get('skipped'):
+                    logger.warning('%s embedding skipped, served exactly instead: %s', col_name, meta['skipped'])
+                else:
+                    logger.info('%s embedding: ranking agreement with the exact top 25 is %.3f', col_name,
+                                meta['agreement'])
+
+        # Also written when nothing was stale but no complete build is on record, e.g. after an interrupted one
+        if self.writing or read_build_id() is None:
+            finish_build()
+            self.writing = False
@@ -0,0 +1,144 @@
+"""
+Compact dense embeddings of the strategy features by truncated SVD.
+
+    python -m processing.embedding --dim 128
+
+Each strategy's L2-normalised bag of words is projected onto its top `dim` singular
+directions and the projections are normalised again, so the dot product of two
+embeddings approximates their cosine. A query is one BLAS matrix-vector product over
+`dim` floats per movie instead of 5000-term rows. The build keeps an embedding only
+when it is smaller than the strategy's sparse features (8 bytes per term against 4
+per dimension) and its top 25 agrees with the exact top 25 at least
+EMBEDDING_MIN_AGREEMENT of the time; other strategies are skipped and served
+exactly. Run as a module it reports how closely the embedding ranking agrees with
+the exact one, and the sizes of both.
+"""
+import argparse
+import os
+import time
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from processing.similarity import STRATEGIES, query_scores, settle, top_k_indices
+from processing.store import artifact_path, load_arrays, load_csr, save_arrays
+
+# Dimensions kept per strategy; fewer only when the catalog or vocabulary is smaller
+EMBEDDING_DIM = int(os.environ.get('CINESCOPE_EMBEDDING_DIM', 128))
+
+# Share of the exact top 25 the embedding top 25 must hold on a sample for the embedding to be served
+EMBEDDING_MIN_AGREEMENT = float(os.environ.get('CINESCOPE_EMBEDDING_MIN_AGREEMENT', 0.8))
+
+EMBEDDING_SEED = 0
+
+
+def embedding_dim(features, dim=EMBEDDING_DIM):
+    # Truncated SVD needs fewer components than either side of the matrix
+    n, terms = features.shape
+    return max(1, min(dim, terms - 1, n - 1))
+
+
+def sparse_bytes(features):
+    return features.data.nbytes + features.indices.nbytes + features.indptr.nbytes
+
+
+def embedding_bytes(vectors, components):
+    # The projection is stored with the vectors, so it counts towards the size
+    return vectors.nbytes + components.nbytes
+
+
+def build_embedding(features, dim=EMBEDDING_DIM, seed=EMBEDDING_SEED):
+    """
+    Returns (vectors, components): unit-length (movies, d) float32 embeddings and
+    the (d, terms) projection used to embed rows transformed later, where d is
+    embedding_dim(features, dim).
+    """
+    dim = embedding_dim(features, dim)
+    svd = TruncatedSVD(n_components=dim, algorithm='randomized', n_iter=5, random_state=seed)
+    svd.fit(features)
+    components = svd.components_.astype(np.float32)
+    return embed(features, components), components
+
+
+def embed(features, components):
+    projected = np.asarray(features @ components.T, dtype=np.float32)
+    return normalize(projected, copy=False)
+
+
+def embedding_scores(vectors, row):
+    # Dense mat-vec over the whole catalog, settled like the exact scores
+    return settle(vectors @ vectors[row])
+
+
+def ranking_agreement(features, vectors, k=25, sample=500, seed=EMBEDDING_SEED):
+    """
+    Share of the embedding top k that belongs to the exact top k, averaged over a
+    random sample of movies. A pick tied with the exact k-th score counts as agreeing.
+    """
+    n = features.shape[0]
+    rows = np.random.default_rng(seed).choice(n, size=min(sample, n), replace=False)
+    agree = 0
+    for row in rows:
+        exact_scores = query_scores(features, row)
+        exact = top_k_indices(exact_scores, k, exclude=(row,))
+        picks = top_k_indices(embedding_scores(vectors, row), k, exclude=(row,))
+        if len(exact):
+            agree += int((exact_scores[picks] >= exact_scores[exact[-1]]).sum())
+    return agree / max(len(rows) * min(k, n - 1), 1)
+
+
+def skip_reason(size, exact_size, agreement, min_agreement=EMBEDDING_MIN_AGREEMENT):
+    # Why the build serves a strategy exactly instead of by its embedding, or None to keep it
+    if size >= exact_size:
+        return f'{size / 2 ** 20:.2f} MB embedding is not smaller than {exact_size / 2 ** 20:.2f} MB of features'
+    if agreement < min_agreement:
+        return f'ranking agreement {agreement:.3f} is below {min_agreement}'
+    return None
+
+
+def save_embedding(path, vectors, components, agreement=None, skipped=None):
+    save_arrays(path, meta={'dim': vectors.shape[1], 'agreement': agreement, 'skipped': skipped},
+                vectors=vectors, components=components)
+
+
+def skipped_embedding(features):
+    # Zero-width stand-in recorded for a strategy served exactly, so its build is not retried every start
+    n, terms = features.shape
+    return np.zeros((n, 0), dtype=np.float32), np.zeros((0, terms), dtype=np.float32)
+
+
+def load_embedding(path):
+    return load_arrays(path, 'vectors', 'components')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ranking agreement and size of SVD embeddings against exact search.')
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM)
+    parser.add_argument('-k', type=int, default=25)
+    parser.add_argument('--sample', type=int, default=500, help='movies compared per strategy')
+    args = parser.parse_args()
+
+    for col_name in STRATEGIES:
+        features = load_csr(artifact_path(f'features_{col_name}'))
+        started = time.perf_counter()
+        vectors, components = build_embedding(features, args.dim)
+        build_time = time.perf_counter() - started
+
+        row = features.shape[0] // 2
+        started = time.perf_counter()
+        query_scores(features, row)
+        exact_ms = 1000 * (time.perf_counter() - started)
+        started = time.perf_counter()
+        embedding_scores(vectors, row)
+        embedding_ms = 1000 * (time.perf_counter() - started)
+
+        size, exact_size = embedding_bytes(vectors, components), sparse_bytes(features)
+        agreement = ranking_agreement(features, vectors, args.k, args.sample)
+        skipped = skip_reason(size, exact_size, agreement)
+        print(f'{col_name}: agreement@{args.k} {agreement:.3f}, {vectors.shape[1]} dims, '
+              f'{size / 2 ** 20:.2f} MB vs {exact_size / 2 ** 20:.2f} MB sparse'
+              f"{f' (skipped by the build: {skipped})' if skipped else ''}, "
+              f'{embedding_ms:.2f} ms vs {exact_ms:.2f} ms per query, built in {build_time:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
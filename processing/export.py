@@ -0,0 +1,200 @@
+"""
+Bulk export of the top-K similar movies of the whole catalog, for every strategy.
+
+    python -m processing.export similar.jsonl -k 10
+    python -m processing.export similar.csv --strategies tags genres --workers 4
+
+The catalog is cut into blocks of rows. A worker computes one block for every
+strategy as a sparse block x catalog product reduced to its top K at once, so memory
+stays at one dense block per worker however large the catalog. When a stored
+neighbour index is fresh for the current build and already holds K neighbours, it is
+read instead. Blocks are written
+in catalog order as soon as they are done, as JSONL (one movie per line), CSV or
+Parquet (one neighbour per row). Rankings and ties match preprocess.recommend.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from processing.build import fresh_artifacts
+from processing.similarity import SCORE_DECIMALS, STRATEGIES, block_rows, top_k_block
+from processing.store import artifact_path, load_arrays, load_csr, load_frame
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+# Per worker process: {col_name: features} and {col_name: stored neighbour indices, scores}
+_features = {}
+_neighbors = {}
+
+
+def _init_worker(strategies, k, stored):
+    # Also run in the calling process when there is one worker, so earlier exports are cleared.
+    # `stored` names the strategies whose neighbour index is fresh for the current build
+    _features.clear()
+    _neighbors.clear()
+    for col_name in strategies:
+        _features[col_name] = load_csr(artifact_path(f'features_{col_name}'))
+        if col_name in stored:
+            indices, scores = load_arrays(artifact_path(f'neighbors_{col_name}'), 'indices', 'scores')
+            if indices.shape[0] == _features[col_name].shape[0] and indices.shape[1] >= k:
+                _neighbors[col_name] = indices, scores
+
+
+def similar_block(start, end, k):
+    """
+    {col_name: (indices, scores)} of rows start..end, each (rows, k) and best first,
+    the movie itself excluded.
+    """
+    results = {}
+    rows = np.arange(start, end)
+    for col_name, features in _features.items():
+        if col_name in _neighbors:
+            indices, scores = _neighbors[col_name]
+            results[col_name] = np.asarray(indices[start:end, :k]), np.asarray(scores[start:end, :k])
+        else:
+            results[col_name] = top_k_block(features[start:end] @ features.T, rows, min(k, features.shape[0] - 1))
+    return start, end, results
+
+
+class JsonlWriter():
+    """
+    One line per movie: {"movie_id", "title", "similar": {strategy: [{"movie_id", "score"}]}}.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, movie_ids, titles, rows, results):
+        lines = []
+        for position, row in enumerate(rows.tolist()):
+            # float32 scores widened to float would print as 0.7000600099563599; round like the CSV
+            similar = {col_name: [{'movie_id': movie_id, 'score': round(score, SCORE_DECIMALS)} for movie_id, score
+                                  in zip(movie_ids[indices[position]].tolist(), scores[position].tolist())]
+                       for col_name, (indices, scores) in results.items()}
+            lines.append(json.dumps({'movie_id': movie_ids[row].item(), 'title': titles[row], 'similar': similar},
+                                    ensure_ascii=False))
+        self._file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def _long_columns(movie_ids, rows, col_name, indices, scores):
+    # One row per (movie, neighbour) pair, built with array operations
+    k = indices.shape[1]
+    return {'movie_id': np.repeat(movie_ids[rows], k), 'strategy': np.full(len(rows) * k, col_name),
+            'rank': np.tile(np.arange(1, k + 1, dtype=np.int16), len(rows)),
+            'similar_movie_id': movie_ids[indices.ravel()], 'score': scores.ravel()}
+
+
+class CsvWriter():
+    """
+    movie_id, strategy, rank, similar_movie_id, score; one row per neighbour.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        csv.writer(self._file).writerow(['movie_id', 'strategy', 'rank', 'similar_movie_id', 'score'])
+
+    def write(self, movie_ids, titles, rows, results):
+        for col_name, (indices, scores) in results.items():
+            columns = _long_columns(movie_ids, rows, col_name, indices, scores)
+            scores_text = np.char.mod(f'%.{SCORE_DECIMALS}f', columns['score'])
+            lines = [f'{movie_id},{col_name},{rank},{similar},{score}' for movie_id, rank, similar, score
+                     in zip(columns['movie_id'].tolist(), columns['rank'].tolist(),
+                            columns['similar_movie_id'].tolist(), scores_text.tolist())]
+            if lines:
+                self._file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter():
+    """
+    Same columns as the CSV, one row group per block. Needs pyarrow.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Parquet export needs pyarrow; install it or export JSONL or CSV')
+        self._pa = pa
+        self._writer = pq.ParquetWriter(path, pa.schema([('movie_id', pa.int64()), ('strategy', pa.string()),
+                                                         ('rank', pa.int16()), ('similar_movie_id', pa.int64()),
+                                                         ('score', pa.float32())]))
+
+    def write(self, movie_ids, titles, rows, results):
+        tables = [self._pa.table(_long_columns(movie_ids, rows, col_name, indices, scores), schema=self._writer.schema)
+                  for col_name, (indices, scores) in results.items()]
+        self._writer.write_table(self._pa.concat_tables(tables))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+def export(path, k=25, strategies=STRATEGIES, fmt=None, workers=None, rows_per_block=None):
+    """
+    Write the top-k similar movies of every catalog movie for each strategy to `path`.
+    The format follows the extension unless `fmt` is given. Returns the number of movies.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}; use one of {', '.join(FORMATS)}")
+
+    catalog = load_frame(artifact_path('new_df'), ['movie_id', 'title'])
+    movie_ids, titles = catalog['movie_id'].to_numpy().astype(np.int64), catalog['title'].tolist()
+    n = len(catalog)
+    rows_per_block = rows_per_block or block_rows(n)
+    blocks = [(start, min(start + rows_per_block, n), k) for start in range(0, n, rows_per_block)]
+    workers = max(1, min(len(blocks), workers or os.cpu_count() or 1))
+    # A neighbour index left from another mode or an older catalog would point at the wrong movies
+    fresh = fresh_artifacts()
+    stored = [col_name for col_name in strategies if f'neighbors_{col_name}' in fresh]
+
+    writer = WRITERS[fmt](path)
+    try:
+        if workers == 1:
+            _init_worker(strategies, k, stored)
+            for block in blocks:
+                start, end, results = similar_block(*block)
+                writer.write(movie_ids, titles, np.arange(start, end), results)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                     initializer=_init_worker, initargs=(strategies, k, stored)) as executor:
+                # At most two blocks per worker in flight, so finished blocks never pile up
+                for window in range(0, len(blocks), workers * 2):
+                    for start, end, results in executor.map(similar_block, *zip(*blocks[window:window + workers * 2])):
+                        writer.write(movie_ids, titles, np.arange(start, end), results)
+    finally:
+        writer.close()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the top-k similar movies of the whole catalog.')
+    parser.add_argument('path', help='output file; .jsonl, .csv or .parquet')
+    parser.add_argument('-k', type=int, default=25)
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, default=STRATEGIES)
+    parser.add_argument('--format', choices=FORMATS, help='output format (default: from the extension)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--block-rows', type=int, default=None, help='movies per block (default: by catalog size)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    n = export(args.path, args.k, args.strategies, args.format, args.workers, args.block_rows)
+    print(f'{n} movies x {len(args.strategies)} strategies written to {args.path} '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Incremental catalog updates.
+
+    python -m processing.ingest delta_movies.csv delta_credits.csv
+    python -m processing.ingest --full
+
+A delta is a pair of CSVs in the TMDB 5000 format holding new or changed movies.
+Frames, feature matrices and neighbour lists are updated only for the movies they
+touch, and the delta is merged into the source CSVs so a later full rebuild (kept
+for vocabulary drift) sees the same catalog. The vocabularies stay as fitted: terms
+outside them are counted, not added. Updated artifacts are recorded in the manifest
+under keys of their own, since they are not what a full build would produce.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from processing import preprocess
+from processing.ann import load_index, save_index, update_index
+from processing.embedding import embed, load_embedding, save_embedding
+from processing.build import SOURCE_CSVS, artifact_keys, build_lock, finish_build, incremental_key, load_manifest, save_manifest, \
+    start_build
+from processing.display import Main
+from processing.lookup import lookup_for
+from processing.similarity import STRATEGIES, analyzer, build_features, update_neighbors
+from processing.store import artifact_path, load_arrays, load_csr, load_frame, load_meta, save_arrays, save_csr, \
+    save_frame
+
+MOVIES_CSV, CREDITS_CSV = SOURCE_CSVS
+
+# Distinct terms outside a vocabulary, as a share of it, seen in deltas before a full rebuild is advised
+VOCABULARY_DRIFT_LIMIT = 0.1
+
+
+def merge_frame(old, delta):
+    """
+    Replace the rows of `old` whose movie_id is in `delta` and append the others.
+    Returns the merged frame and the positions of every row that changed.
+    """
+    id_to_row = lookup_for(old).id_to_row
+    columns = {col: old[col].tolist() for col in old.columns}
+    changed = []
+
+    new_rows = []
+    for i, movie_id in enumerate(delta['movie_id'].tolist()):
+        row = id_to_row.get(movie_id)
+        if row is None:
+            new_rows.append(i)
+            continue
+        for col in old.columns:
+            columns[col][row] = delta[col].iloc[i]
+        changed.append(row)
+
+    for i in new_rows:
+        changed.append(len(columns['movie_id']))
+        for col in old.columns:
+            columns[col].append(delta[col].iloc[i])
+
+    return pd.DataFrame(columns, columns=old.columns), sorted(set(changed))
+
+
+def update_features(col_name, texts, changed):
+    """
+    Transform the changed rows with the stored vocabulary, which stays fixed until a
+    full rebuild refits it, so no other row changes. Returns the new features, the
+    meta to store with them, the changed rows, the number of their terms outside the
+    vocabulary and the share of the vocabulary such terms make up over all deltas.
+    """
+    features_path = artifact_path(f'features_{col_name}')
+    features = load_csr(features_path)
+    meta = load_meta(features_path)
+    vocabulary = meta['vocabulary']
+    old_n = features.shape[0]
+    affected = np.array(sorted(changed), dtype=np.int64)
+    changed_texts = [texts[row] for row in affected]
+
+    # Either new to the catalog or left out by max_features; only a refit can tell
+    known = set(vocabulary)
+    tokenize = analyzer()
+    unseen = {term for text in changed_texts for term in tokenize(text) if term not in known}
+    unseen_terms = sorted(unseen.union(meta.get('unseen_terms', [])))
+
+    n = len(texts)
+    base = sp.csr_matrix((features.data, features.indices, features.indptr), shape=(old_n, len(vocabulary)))
+    base = sp.vstack([base, sp.csr_matrix((n - old_n, len(vocabulary)), dtype=np.float32)]).tocsr()
+
+    # Swap the affected rows in with two sparse products instead of editing the CSR structure
+    keep = np.ones(n, dtype=np.float32)
+    keep[affected] = 0
+    fresh = build_features(changed_texts, vocabulary=vocabulary)[0]
+    scatter = sp.csr_matrix((np.ones(len(affected), dtype=np.float32), (affected, np.arange(len(affected)))),
+                            shape=(n, len(affected)))
+    updated = (sp.diags(keep) @ base + scatter @ fresh).tocsr()
+    updated.sort_indices()
+
+    drift = len(unseen_terms) / max(len(vocabulary), 1)
+    meta = {'vocabulary': vocabulary, 'unseen_terms': unseen_terms}
+    return updated.astype(np.float32), meta, affected, len(unseen), drift
+
+
+def ingest_delta(movies_csv, credits_csv):
+    # Under the build lock, so a server starting meanwhile never builds from a half-merged catalog
+    with build_lock():
+        return _ingest(movies_csv, credits_csv)
+
+
+def _ingest(movies_csv, credits_csv):
+    timings = {}
+    started = time.perf_counter()
+
+    # Artifacts built before vocabularies were stored cannot be extended, only rebuilt
+    for col_name in STRATEGIES:
+        if not os.path.exists(os.path.join(artifact_path(f'features_{col_name}'), 'meta.json')):
+            raise FileNotFoundError(f'features_{col_name} has no stored vocabulary; run a full rebuild (--full) first')
+
+    delta_movies, delta_new_df, delta_movies2 = preprocess.read_csv_to_df(movies_csv, credits_csv)
+
+    merged = {}
+    changed = {}
+    for name, delta in (('movies', delta_movies), ('movies2', delta_movies2), ('new_df', delta_new_df)):
+        old = load_frame(artifact_path(name))
+        merged[name], changed[name] = merge_frame(old, delta[old.columns])
+    timings['frames'] = time.perf_counter() - started
+
+    new_df = merged['new_df']
+    rows = changed['new_df']
+
+    # Frames first: old feature and neighbour rows keep their positions in the merged frame.
+    # Snapshots keep serving the previous build until finish_build() below
+    start_build()
+    for name, frame in merged.items():
+        save_frame(artifact_path(name), frame)
+
+    report = {}
+    for col_name in STRATEGIES:
+        stage = time.perf_counter()
+        features, meta, affected, unseen, drift = update_features(col_name, new_df[col_name].tolist(), rows)
+        save_csr(artifact_path(f'features_{col_name}'), features, meta=meta)
+
+        neighbors_path = artifact_path(f'neighbors_{col_name}')
+        if os.path.exists(neighbors_path):
+            indices, scores = load_arrays(neighbors_path, 'indices', 'scores')
+            indices, scores = update_neighbors(features, indices, scores, affected)
+            save_arrays(neighbors_path, indices=indices, scores=scores)
+
+        ann_path = artifact_path(f'ann_{col_name}')
+        index = load_index(ann_path) if os.path.exists(ann_path) else None
+        if index is not None:
+            # Only the changed movies are re-hashed with the stored hyperplanes
+            save_index(ann_path, update_index(index, features, affected), load_meta(ann_path).get('stats'))
+
+        embedding_path = artifact_path(f'embedding_{col_name}')
+        if os.path.exists(embedding_path):
+            # The other rows keep their vectors; the changed ones are projected with the stored SVD directions
+            vectors, components = load_embedding(embedding_path)
+            vectors = np.vstack([vectors, np.zeros((len(new_df) - len(vectors), vectors.shape[1]), vectors.dtype)])
+            if vectors.shape[1]:
+                vectors[affected] = embed(features[affected], np.asarray(components))
+            meta = load_meta(embedding_path)
+            save_embedding(embedding_path, vectors, np.asarray(components), meta.get('agreement'), meta.get('skipped'))
+
+        report[col_name] = {'affected': len(affected), 'unseen': unseen, 'drift': drift}
+        timings[col_name] = time.perf_counter() - stage
+
+    merge_source_csvs(movies_csv, credits_csv)
+
+    # The artifacts stand in for a build of the merged CSVs but differ from one (row order, fixed
+    # vocabulary, merged neighbour lists), so they get keys of their own chained from the delta.
+    # Startup serves them until the inputs or code change or --full replaces them
+    manifest = load_manifest()
+    keys = artifact_keys(manifest)
+    incremental = manifest.setdefault('incremental', {})
+    for name, key in keys.items():
+        if os.path.exists(artifact_path(name)):
+            manifest['artifacts'][name] = incremental_key(manifest['artifacts'].get(name), movies_csv, credits_csv)
+            incremental[name] = {'key': manifest['artifacts'][name], 'inputs': key}
+    save_manifest(manifest)
+    finish_build()
+    timings['total'] = time.perf_counter() - started
+    return report, timings
+
+
+def merge_source_csvs(movies_csv, credits_csv):
+    # Keeps the CSVs in step with the artifacts, so a full rebuild reproduces the same catalog
+    for source, delta, key in ((MOVIES_CSV, movies_csv, 'id'), (CREDITS_CSV, credits_csv, 'movie_id')):
+        merged = pd.concat([pd.read_csv(source), pd.read_csv(delta)], ignore_index=True)
+        merged = merged.drop_duplicates(subset=key, keep='last')
+        tmp_path = f'{source}.{os.getpid()}.tmp'
+        merged.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, source)
+
+
+def full_rebuild():
+    # Every artifact is recomputed from the CSVs and swapped in directory by directory
+    started = time.perf_counter()
+    with Main(rebuild=True) as bot:
+        bot.main_()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the CineScope artifacts with new or changed TMDB movies.')
+    parser.add_argument('movies_csv', nargs='?', help='delta in the tmdb_5000_movies.csv format')
+    parser.add_argument('credits_csv', nargs='?', help='delta in the tmdb_5000_credits.csv format')
+    parser.add_argument('--full', action='store_true', help='rebuild every artifact from the source CSVs')
+    args = parser.parse_args()
+
+    if args.full:
+        print(f'Full rebuild finished in {full_rebuild():.1f}s')
+        return
+    if not args.movies_csv or not args.credits_csv:
+        parser.error('a movies and a credits delta CSV are required unless --full is given')
+
+    report, timings = ingest_delta(args.movies_csv, args.credits_csv)
+    for col_name, stats in report.items():
+        print(f"{col_name}: {stats['affected']} rows updated, {stats['unseen']} terms outside the vocabulary, "
+              f"vocabulary drift {stats['drift']:.1%} ({timings[col_name]:.2f}s)")
+        if stats['drift'] > VOCABULARY_DRIFT_LIMIT:
+            print(f'  {col_name} vocabulary has drifted; run with --full to refit it')
+    print(f"Done in {timings['total']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import weakref
+import numpy as np
+
+
+class MovieLookup():
+    """
+    Constant-time title/movie_id -> row lookups for one dataframe, plus
+    row -> title and row -> movie_id arrays. Rows are positions (iloc).
+    Duplicate titles (remakes) and ids resolve to their first row, which is
+    what the old `df[df['title'] == title].index[0]` scans returned.
+    """
+
+    def __init__(self, df):
+        self.titles = df['title'].to_numpy(dtype=object)
+        self.movie_ids = df['movie_id'].to_numpy()
+
+        self.title_to_row = {}
+        for row, title in enumerate(self.titles):
+            self.title_to_row.setdefault(title, row)
+
+        # First row carrying the same title, used to de-duplicate remakes across lists
+        self.title_rows = np.fromiter((self.title_to_row[title] for title in self.titles),
+                                      dtype=np.int64, count=len(self.titles))
+
+        self.id_to_row = {}
+        for row, movie_id in enumerate(self.movie_ids.tolist()):
+            self.id_to_row.setdefault(movie_id, row)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def row(self, title):
+        return self.title_to_row[title]
+
+    def row_for_id(self, movie_id):
+        return self.id_to_row[int(movie_id)]
+
+
+# One lookup per live dataframe, dropped again when the frame is garbage collected
+_lookups = {}
+
+
+def lookup_for(df):
+    key = id(df)
+    lookup = _lookups.get(key)
+    if lookup is None:
+        lookup = MovieLookup(df)
+        _lookups[key] = lookup
+        weakref.finalize(df, _lookups.pop, key, None)
+    return lookup
+
+
+def rows_to_records(lookup, rows):
+    # Titles and ids for a batch of rows via array indexing, no per-row iloc
+    rows = np.asarray(rows, dtype=np.int64)
+    return lookup.titles[rows].tolist(), lookup.movie_ids[rows].tolist()
@@ -0,0 +1,231 @@
+"""
+Timing spans and counters for the serving hot path.
+
+    CINESCOPE_METRICS=1 streamlit run main.py
+
+Spans time a stage (artifact load, title lookup, each recommend, poster and cast
+fetches) into a per-process latency histogram; counters count events such as TMDB
+cache hits and misses. Both are labelled, and rendered in the Prometheus text format
+by prometheus_text(), written to CINESCOPE_METRICS_FILE every few seconds for a
+textfile collector, and shown in the debug sidebar with CINESCOPE_METRICS_SIDEBAR=1.
+Every span is also logged as one JSON line at DEBUG level, and at INFO when slow.
+
+Disabled (the default), timed() returns the function itself and span() and count()
+return at once, so instrumented code costs a function call at most.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('CINESCOPE_METRICS', '') not in ('', '0')
+
+# Prometheus textfile written periodically while metrics are enabled
+METRICS_FILE = os.environ.get('CINESCOPE_METRICS_FILE')
+METRICS_FILE_INTERVAL = 15
+
+# Show span timings and the Prometheus dump in a Streamlit sidebar
+METRICS_SIDEBAR = METRICS_ENABLED and os.environ.get('CINESCOPE_METRICS_SIDEBAR', '') not in ('', '0')
+
+# Spans at least this slow are logged at INFO rather than DEBUG
+SLOW_SPAN_MS = float(os.environ.get('CINESCOPE_METRICS_SLOW_MS', 500))
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_SPAN = nullcontext()
+
+
+class Registry():
+    """
+    Thread-safe counters and latency histograms keyed by (name, labels).
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def count(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of observations
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+
+    def snapshot(self):
+        """
+        Copies of the counters {(name, labels): value} and histograms
+        {(name, labels): (bucket_counts, total_seconds)}.
+        """
+        with self._lock:
+            return dict(self._counters), {key: (list(counts), total) for key, (counts, total)
+                                          in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+def _labels(labels):
+    # Sorted so the same labels passed in another order land on the same series
+    return tuple(sorted((key, str(value).lower() if isinstance(value, bool) else str(value))
+                        for key, value in labels.items()))
+
+
+class _Span():
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        labels = self.labels + (('error', exc_type.__name__),) if exc_type else self.labels
+        registry.observe(self.name, labels, seconds)
+        level = logging.INFO if seconds * 1000 >= SLOW_SPAN_MS else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, '%s', json.dumps({'span': self.name, 'ms': round(seconds * 1000, 3),
+                                                **dict(labels)}))
+        return False
+
+
+def span(name, **labels):
+    """
+    Context manager timing its block into the `name` histogram. A block that raises
+    is recorded with an `error` label naming the exception.
+    """
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(name, _labels(labels))
+
+
+def timed(name=None, **labels):
+    # Decorator form of span(); without metrics the function is returned unwrapped
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(span_name, _labels(labels)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    if METRICS_ENABLED:
+        registry.count(name, _labels(labels), value)
+
+
+def _series(name, labels, extra=()):
+    labels = labels + extra
+    if not labels:
+        return name
+    escaped = ','.join('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                       for key, value in labels)
+    return f'{name}{{{escaped}}}'
+
+
+def prometheus_text(prefix='cinescope_'):
+    """
+    Every counter and histogram in the Prometheus text exposition format. Span
+    histograms are named <prefix><span>_seconds, counters <prefix><name>_total.
+    """
+    counters, histograms = registry.snapshot()
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        metric = f'{prefix}{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        for (series_name, labels), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f'{_series(metric, labels)} {value}')
+
+    for name in sorted({name for name, _ in histograms}):
+        metric = f'{prefix}{name}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for (series_name, labels), (counts, total) in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(registry.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{_series(metric + '_bucket', labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{_series(metric + '_sum', labels)} {total:.6f}")
+            lines.append(f"{_series(metric + '_count', labels)} {cumulative}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def span_summary():
+    """
+    One row per span series, slowest total first: name, labels, calls, mean and
+    total milliseconds. Used by the debug sidebar.
+    """
+    _, histograms = registry.snapshot()
+    rows = []
+    for (name, labels), (counts, total) in histograms.items():
+        calls = sum(counts)
+        rows.append({'span': name, 'labels': ' '.join(f'{key}={value}' for key, value in labels), 'calls': calls,
+                     'mean_ms': round(1000 * total / calls, 2), 'total_ms': round(1000 * total, 1)})
+    return sorted(rows, key=lambda row: -row['total_ms'])
+
+
+def write_prometheus(path):
+    # Written beside the target and renamed, so a collector never reads a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as metrics_file:
+        metrics_file.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def _write_periodically(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_prometheus(path)
+        except OSError:
+            logger.exception('Could not write metrics to %s', path)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start_file_writer(path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    # One daemon thread per process rewriting the textfile; a no-op when disabled or unset
+    global _writer
+    if not METRICS_ENABLED or not path or _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_periodically, args=(path, interval), name='metrics-writer',
+                                       daemon=True)
+            _writer.start()
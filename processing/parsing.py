@@ -0,0 +1,87 @@
+import ast
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# orjson is optional; the standard library decoder is used when it is not installed
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Number of billed cast members kept per movie
+CAST_DEPTH = 10
+
+# Below this many rows the parse stays in-process; worker start-up would cost more than it saves
+PARALLEL_MIN_ROWS = 20000
+
+# Raw TMDB columns holding JSON lists, and the list columns parsed out of them
+RAW_COLUMNS = ['genres', 'keywords', 'cast', 'crew', 'production_companies']
+PARSED_COLUMNS = ['genres', 'keywords', 'top_cast', 'director', 'prduction_comp', 'tcast', 'tcrew', 'tprduction_comp']
+
+
+def load_list(obj):
+    # TMDB exports are JSON; literal_eval is only the fallback for Python-repr rows
+    try:
+        return _loads(obj)
+    except ValueError:
+        return ast.literal_eval(obj)
+
+
+def _strip(names):
+    return [name.replace(" ", "") for name in names]
+
+
+def parse_rows(genres, keywords, cast, crew, companies, cast_depth=CAST_DEPTH):
+    """
+    Parse one shard of the raw JSON columns in a single pass. Returns the list
+    columns of PARSED_COLUMNS; the t* columns have the spaces removed from names.
+    """
+    parsed = {col: [] for col in PARSED_COLUMNS}
+    for row in zip(genres, keywords, cast, crew, companies):
+        genre_names = [item['name'] for item in load_list(row[0])]
+        keyword_names = [item['name'] for item in load_list(row[1])]
+        top_cast = [item['name'] for item in load_list(row[2])[:cast_depth]]
+        director = [item['name'] for item in load_list(row[3]) if item['job'] == 'Director'][:1]
+        companies_names = [item['name'] for item in load_list(row[4])]
+
+        parsed['genres'].append(_strip(genre_names))
+        parsed['keywords'].append(_strip(keyword_names))
+        parsed['top_cast'].append(top_cast)
+        parsed['director'].append(director)
+        parsed['prduction_comp'].append(companies_names)
+        parsed['tcast'].append(_strip(top_cast))
+        parsed['tcrew'].append(_strip(director))
+        parsed['tprduction_comp'].append(_strip(companies_names))
+    return parsed
+
+
+def _parse_shard(shard):
+    return parse_rows(*shard)
+
+
+def parse_columns(frame, workers=None):
+    """
+    Parse the RAW_COLUMNS of a movies frame. Large frames are split into shards
+    and parsed in a process pool; shards come back in order.
+    """
+    columns = [frame[col].tolist() for col in RAW_COLUMNS]
+    n = len(frame)
+    workers = workers or os.cpu_count() or 1
+    if n < PARALLEL_MIN_ROWS or workers == 1:
+        return parse_rows(*columns)
+
+    shard_size = math.ceil(n / (workers * 4))
+    shards = [[col[start:start + shard_size] for col in columns] for start in range(0, n, shard_size)]
+
+    parsed = {col: [] for col in PARSED_COLUMNS}
+    # spawn keeps the workers free of the parent's threads (e.g. a running Streamlit server)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as executor:
+        for result in executor.map(_parse_shard, shards):
+            for col in PARSED_COLUMNS:
+                parsed[col].extend(result[col])
+    return parsed
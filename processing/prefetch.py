@@ -0,0 +1,110 @@
+"""
+Background warming of the TMDB metadata cache.
+
+While a user reads a page, the posters of the neighbouring catalog pages and the cast
+of the top recommendations are fetched into the persistent cache, so the next
+navigation step is answered locally. Each session (owner) has at most one batch of
+work queued; scheduling a new batch cancels what is left of the old one.
+"""
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from processing.tmdb import tmdb_client
+
+# Prefetch threads; kept below the TMDB client's pool so page loads are never starved
+PREFETCH_WORKERS = 3
+
+# Catalog pages warmed around the current one, nearest first
+PREFETCH_PAGE_OFFSETS = (1, -1, 2, -2)
+
+
+class Prefetcher():
+    """
+    Runs (kind, key) lookups on a small thread pool. Work is grouped by owner, and
+    schedule() for an owner drops that owner's queued and not yet started lookups.
+    """
+
+    def __init__(self, client=None, workers=PREFETCH_WORKERS):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        # Per owner with a batch in progress: its futures and generation; dropped once the batch is over
+        self._pending = {}
+        self._generation = {}
+        self._generations = itertools.count(1)
+
+    def schedule(self, owner, jobs):
+        """
+        Queue `jobs`, a list of ('movie' | 'person', id) pairs, for `owner` and cancel
+        the owner's previous batch. Returns the futures of the new batch.
+        """
+        with self._lock:
+            previous = self._drop(owner)
+            futures = []
+            if jobs:
+                generation = next(self._generations)
+                self._generation[owner] = generation
+                futures = [self._executor.submit(self._fetch, owner, generation, kind, key) for kind, key in jobs]
+                self._pending[owner] = futures
+        # Outside the lock, since cancelling runs the done-callbacks in this thread
+        for future in previous:
+            future.cancel()
+        for future in futures:
+            future.add_done_callback(functools.partial(self._finished, owner, generation))
+        return futures
+
+    def cancel(self, owner):
+        with self._lock:
+            previous = self._drop(owner)
+        for future in previous:
+            future.cancel()
+
+    def _drop(self, owner):
+        # Forget the owner's batch (with the lock held) and return its futures
+        self._generation.pop(owner, None)
+        return self._pending.pop(owner, ())
+
+    def _finished(self, owner, generation, future):
+        # The last lookup of a batch to finish or be cancelled removes the owner's entries
+        with self._lock:
+            if self._generation.get(owner) == generation and all(f.done() for f in self._pending[owner]):
+                self._drop(owner)
+
+    def _fetch(self, owner, generation, kind, key):
+        # A newer batch for the same owner means the user has moved on
+        if self._generation.get(owner) != generation:
+            return None
+        client = self.client or tmdb_client()
+        fetch = client.movie if kind == 'movie' else client.person
+        try:
+            return fetch(key)
+        except Exception:
+            # Best effort only; the page itself will fetch and report failures
+            return None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def prefetcher():
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def page_jobs(movie_ids, start, page_size=10, offsets=PREFETCH_PAGE_OFFSETS):
+    # Posters of the pages around the one starting at `start`
+    jobs = []
+    for offset in offsets:
+        page_start = start + offset * page_size
+        if 0 <= page_start < len(movie_ids):
+            jobs.extend(('movie', int(movie_id)) for movie_id in movie_ids[page_start:page_start + page_size])
+    return jobs
@@ -1,17 +1,19 @@
-import string
-import pickle
+import logging
+import time
+import numpy as np
 import pandas as pd
-import ast
-import requests
 import nltk
-from nltk.corpus import stopwords
-from nltk.stem.porter import PorterStemmer
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import streamlit as st
-
-# Object for porterStemmer
-ps = PorterStemmer()
+from processing.artifacts import artifacts_for
+from processing.lookup import lookup_for, rows_to_records
+from processing.parsing import CAST_DEPTH, PARSED_COLUMNS, load_list, parse_columns
+from processing.embedding import embedding_scores
+from processing.metrics import count, span, timed
+from processing.text import Normaliser
+from processing.tmdb import PROFILE_BASE_URL, poster_url, tmdb_client
+from processing.similarity import NEIGHBOR_K, RECOMMEND_MODE, STRATEGIES, feature_matrix, first_k_allowed, \
+    hybrid_scores, query_scores, sparse_similarity, top_k_indices
+
+logger = logging.getLogger(__name__)
 
 # Ensure stopwords are available once; avoid repeated downloads on every rerun
 try:
@@ -21,36 +23,29 @@ except LookupError:
 
 
 def get_genres(obj):
-    lista = ast.literal_eval(obj)
-    l1 = []
-    for i in lista:
-        l1.append(i['name'])
-    return l1
+    return [i['name'] for i in load_list(obj)]
 
 
 def get_cast(obj):
-    a = ast.literal_eval(obj)
-    l_ = []
-    len_ = len(a)
-    for i in range(0, 10):
-        if i < len_:
-            l_.append(a[i]['name'])
-    return l_
+    return [i['name'] for i in load_list(obj)[:CAST_DEPTH]]
 
 
 def get_crew(obj):
-    l1 = []
-    for i in ast.literal_eval(obj):
-        if i['job'] == 'Director':
-            l1.append(i['name'])
-            break
-    return l1
+    return [i['name'] for i in load_list(obj) if i['job'] == 'Director'][:1]
 
 
-def read_csv_to_df():
+def read_csv_to_df(movies_path=r'Files/tmdb_5000_movies.csv', credits_path=r'Files/tmdb_5000_credits.csv',
+                   timings=None):
+    """
+    Build the movies, new_df and movies2 frames from the TMDB CSVs.
+    If a dict is passed as `timings`, the seconds spent in each stage are stored in it.
+    """
+    timings = {} if timings is None else timings
+    started = stage = time.perf_counter()
+
     #  Reading both the csv files
-    credit_ = pd.read_csv(r'Files/tmdb_5000_credits.csv')
-    movies = pd.read_csv(r'Files/tmdb_5000_movies.csv')
+    credit_ = pd.read_csv(credits_path)
+    movies = pd.read_csv(movies_path)
 
     # Merging the dataframes
     movies = movies.merge(credit_, on='title')
@@ -62,250 +57,278 @@ def read_csv_to_df():
 
     #  Extracting important and relevant features
     movies = movies[
-        ['movie_id', 'title', 'overview', 'genres', 'keywords', 'cast', 'crew', 'production_companies', 'release_date']]
-    movies.dropna(inplace=True)
-
-    # df[df['column_name'] == some_condition]['target_column'] = new_value
-    # df.loc[df['column_name'] == some_condition, 'target_column'] = new_value
-
-    #  Applying functions to convert from list to only items.
-    movies['genres'] = movies['genres'].apply(get_genres)
-    movies['keywords'] = movies['keywords'].apply(get_genres)
-    movies['top_cast'] = movies['cast'].apply(get_cast)
-    movies['director'] = movies['crew'].apply(get_crew)
-    movies['prduction_comp'] = movies['production_companies'].apply(get_genres)
-
-    #  Removing spaces from between the lines
-    movies['overview'] = movies['overview'].apply(lambda x: x.split())
-    movies['genres'] = movies['genres'].apply(lambda x: [i.replace(" ", "") for i in x])
-    movies['keywords'] = movies['keywords'].apply(lambda x: [i.replace(" ", "") for i in x])
-    movies['tcast'] = movies['top_cast'].apply(lambda x: [i.replace(" ", "") for i in x])
-    movies['tcrew'] = movies['director'].apply(lambda x: [i.replace(" ", "") for i in x])
-    movies['tprduction_comp'] = movies['prduction_comp'].apply(lambda x: [i.replace(" ", "") for i in x])
+        ['movie_id', 'title', 'overview', 'genres', 'keywords', 'cast', 'crew', 'production_companies',
+         'release_date']].dropna()
+    timings['read'], stage = time.perf_counter() - stage, time.perf_counter()
+
+    #  One JSON pass over the list columns (sharded over processes for large catalogs),
+    #  also removing the spaces from names for the t* columns
+    parsed = parse_columns(movies)
+    for col in PARSED_COLUMNS:
+        movies[col] = parsed[col]
+    timings['parse'], stage = time.perf_counter() - stage, time.perf_counter()
 
     # Creating a tags where we have all the words together for analysis
+    movies['overview'] = movies['overview'].str.split()
     movies['tags'] = movies['overview'] + movies['genres'] + movies['keywords'] + movies['tcast'] + movies['tcrew']
 
     #  Creating new dataframe for the analysis part only.
-    new_df = movies[['movie_id', 'title', 'tags', 'genres', 'keywords', 'tcast', 'tcrew', 'tprduction_comp']]
+    new_df = movies[['movie_id', 'title', 'tags', 'genres', 'keywords', 'tcast', 'tcrew', 'tprduction_comp']].copy()
 
-    # new_df['tags'] = new_df['tags'].apply(lambda x: " ".join(x))
-    new_df['genres'] = new_df['genres'].apply(lambda x: " ".join(x))
-    # new_df['keywords'] = new_df['keywords'].apply(lambda x: " ".join(x))
-    new_df['tcast'] = new_df['tcast'].apply(lambda x: " ".join(x))
-    new_df['tprduction_comp'] = new_df['tprduction_comp'].apply(lambda x: " ".join(x))
-
-    new_df['tcast'] = new_df['tcast'].apply(lambda x: x.lower())
-    new_df['genres'] = new_df['genres'].apply(lambda x: x.lower())
-    new_df['tprduction_comp'] = new_df['tprduction_comp'].apply(lambda x: x.lower())
+    new_df['genres'] = new_df['genres'].str.join(' ').str.lower()
+    new_df['tcast'] = new_df['tcast'].str.join(' ').str.lower()
+    new_df['tprduction_comp'] = new_df['tprduction_comp'].str.join(' ').str.lower()
+    timings['text'], stage = time.perf_counter() - stage, time.perf_counter()
 
     #  Applying stemming on tags and tags and keywords
-    new_df['tags'] = new_df['tags'].apply(stemming_stopwords)
-    new_df['keywords'] = new_df['keywords'].apply(stemming_stopwords)
+    new_df['tags'] = _normaliser().normalise_column(new_df['tags'])
+    new_df['keywords'] = _normaliser().normalise_column(new_df['keywords'])
+    timings['stem'] = time.perf_counter() - stage
+    timings['total'] = time.perf_counter() - started
+
+    logger.info('read_csv_to_df: %s', ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items()))
 
     return movies, new_df, movies2
 
 
 def stemming_stopwords(li):
-    ans = []
+    return _normaliser().normalise(li)
 
-    # ps = PorterStemmer()
 
-    for i in li:
-        ans.append(ps.stem(i))
+_shared_normaliser = None
 
-    # Removing Stopwords
-    stop_words = set(stopwords.words('english'))
-    filtered_sentence = []
-    for w in ans:
-        w = w.lower()
-        if w not in stop_words:
-            filtered_sentence.append(w)
 
-    str_ = ''
-    for i in filtered_sentence:
-        if len(i) > 2:
-            str_ = str_ + i + ' '
+def _normaliser():
+    # Created on first use, after the stopwords corpus is known to be available
+    global _shared_normaliser
+    if _shared_normaliser is None:
+        _shared_normaliser = Normaliser()
+    return _shared_normaliser
 
-    # Removing Punctuations
-    punc = string.punctuation
-    str_.translate(str_.maketrans('', '', punc))
-    return str_
 
-
-@st.cache_data(show_spinner=False, ttl=3600)
 def fetch_posters(movie_id):
     """
     Fetch poster URL from TMDB API using movie ID.
     Returns None if poster is not available.
-    Cached for 1 hour to improve performance.
+    Kept by the persistent TMDB metadata cache; the app adds its own Streamlit cache.
     """
     try:
-        response = requests.get(
-            f'https://api.themoviedb.org/3/movie/{movie_id}?api_key=6177b4297dff132d300422e0343471fb',
-            timeout=3
-        )
-        data = response.json()
-        
-        if 'poster_path' in data and data['poster_path']:
-            return f"https://image.tmdb.org/t/p/w300{data['poster_path']}"
-        return None
+        return poster_url(tmdb_client().movie(movie_id, timeout=3))
     except Exception:
         return None
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
 def fetch_posters_batch(movie_ids):
     """
-    Fetch multiple posters at once using concurrent requests for better performance.
-    Returns a dictionary mapping movie_id to poster URL.
+    Fetch multiple posters at once on the shared TMDB worker pool, over kept-alive connections.
+    Returns a dictionary mapping movie_id to poster URL; posters not fetched within 5 seconds are left out.
     """
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    
+    results = tmdb_client().fetch_many(tmdb_client().movie, movie_ids, timeout=5)
     posters = {}
-    
-    def fetch_single(movie_id):
-        try:
-            response = requests.get(
-                f'https://api.themoviedb.org/3/movie/{movie_id}?api_key=6177b4297dff132d300422e0343471fb',
-                timeout=3
-            )
-            data = response.json()
-            if 'poster_path' in data and data['poster_path']:
-                return movie_id, f"https://image.tmdb.org/t/p/w300{data['poster_path']}"
-        except Exception:
-            pass
-        return movie_id, None
-    
-    # Fetch up to 10 posters concurrently
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(fetch_single, mid): mid for mid in movie_ids}
-        for future in as_completed(futures):
-            movie_id, poster = future.result()
-            if poster:
-                posters[movie_id] = poster
-    
+    for movie_id, data in results.items():
+        poster = poster_url(data)
+        if poster:
+            posters[movie_id] = poster
     return posters
 
 
-@st.cache_resource(show_spinner=False)
-def _load_similarity(pickle_file_path):
-    with open(pickle_file_path, 'rb') as pickle_file:
-        similarity_tags = pickle.load(pickle_file)
-    return similarity_tags
+def _load_neighbors(new_df, col_name):
+    # Memory-mapped arrays of the artifact snapshot new_df came from, shared by every session
+    return artifacts_for(new_df).neighbors(col_name)
 
 
-def recommend(new_df, movie, pickle_file_path):
-    similarity_tags = _load_similarity(pickle_file_path)
+def _load_features(new_df, col_name):
+    return artifacts_for(new_df).features(col_name)
 
-    movie_idx = new_df[new_df['title'] == movie].index[0]
 
-    # Getting the top 25 movies from the list which are most similar
-    movie_list = sorted(list(enumerate(similarity_tags[movie_idx])), reverse=True, key=lambda x: x[1])[1:26]
+def _row_scores(new_df, col_name, movie_idx):
+    # Similarities of one movie with every movie: embedding dot products in embedding mode, else exact
+    if RECOMMEND_MODE == 'embedding':
+        vectors = artifacts_for(new_df).embedding(col_name)
+        if vectors is not None:
+            return embedding_scores(vectors, movie_idx)
+    return query_scores(_load_features(new_df, col_name), movie_idx)
 
-    rec_movie_list = []
-    rec_movie_ids = []
 
-    for i in movie_list:
-        rec_movie_list.append(new_df.iloc[i[0]]['title'])
-        rec_movie_ids.append(new_df.iloc[i[0]]['movie_id'])
+def _ann_candidates(new_df, col_name, movie_idx, k, exclude):
+    # Approximate top k from the LSH index; None when there is no index or its buckets ran short
+    index = artifacts_for(new_df).ann(col_name)
+    if index is None:
+        return None
+    candidates = index.query(_load_features(new_df, col_name), movie_idx, k, exclude=exclude)
+    return candidates if len(candidates) == k else None
+
+
+def _movie_row(lookup, movie):
+    # A title (duplicates resolve to their first row), or a row position the caller already resolved
+    if isinstance(movie, (int, np.integer)):
+        return int(movie)
+    return lookup.row(movie)
+
+
+def recommend(new_df, movie, col_name, k=25, exclude=()):
+    """
+    Titles and movie ids of the k movies most similar to `movie` for one strategy.
+    `movie` is a title or a row position of new_df. `exclude` holds row positions
+    that must not be returned; the movie itself never is.
+    """
+    with span('title_lookup'):
+        lookup = lookup_for(new_df)
+        movie_idx = _movie_row(lookup, movie)
+    exclude = set(exclude)
+    exclude.add(movie_idx)
+
+    # Getting the top k movies which are most similar, by partial selection rather than a full sort
+    with span('recommend', strategy=col_name, mode=RECOMMEND_MODE):
+        movie_list = None
+        if RECOMMEND_MODE == 'ann':
+            movie_list = _ann_candidates(new_df, col_name, movie_idx, k, exclude)
+        elif RECOMMEND_MODE not in ('query', 'embedding'):
+            indices, _ = _load_neighbors(new_df, col_name)
+            movie_list = first_k_allowed(indices[movie_idx], k, exclude)
+        if movie_list is None:
+            # Query or embedding mode, or the stored neighbour list / LSH buckets ran out after exclusions
+            movie_list = top_k_indices(_row_scores(new_df, col_name, movie_idx), k, exclude=exclude)
+
+    rec_movie_list, rec_movie_ids = rows_to_records(lookup, movie_list)
 
     return rec_movie_list, rec_movie_ids
 
 
+@timed()
+def recommend_hybrid(new_df, movie, weights, k=25, exclude=()):
+    """
+    Titles and movie ids of the k movies with the highest weighted sum of strategy
+    similarities. `weights` maps strategy columns to weights; missing ones count 0.
+    Costs one sparse mat-vec product, about the same as a single-strategy query.
+    """
+    with span('title_lookup'):
+        lookup = lookup_for(new_df)
+        movie_idx = _movie_row(lookup, movie)
+    exclude = set(exclude)
+    exclude.add(movie_idx)
+
+    stacked, offsets = artifacts_for(new_df).hybrid_features()
+    scores = hybrid_scores(stacked, offsets, movie_idx, [weights.get(col_name, 0.0) for col_name in STRATEGIES])
+    return rows_to_records(lookup, top_k_indices(scores, k, exclude=exclude))
+
+
+def _ranked_candidates(new_df, col_name, movie_idx, full=False):
+    # Ranked neighbour rows of one movie; the whole row ranking when full is set
+    if RECOMMEND_MODE == 'ann' and not full:
+        candidates = _ann_candidates(new_df, col_name, movie_idx, NEIGHBOR_K, (movie_idx,))
+        if candidates is not None:
+            return candidates
+    elif RECOMMEND_MODE not in ('query', 'embedding') and not full:
+        indices, _ = _load_neighbors(new_df, col_name)
+        return np.asarray(indices[movie_idx])
+    scores = _row_scores(new_df, col_name, movie_idx)
+    return top_k_indices(scores, len(scores) if full else NEIGHBOR_K, exclude=(movie_idx,))
+
+
+@timed()
+def recommend_all(new_df, movie, strategies, k_per_strategy=3):
+    """
+    Recommendations for several strategies in one pass. The movie is resolved once
+    and a title shown by an earlier strategy is never repeated by a later one.
+    Returns {strategy: (titles, movie_ids)} in the order of `strategies`.
+    """
+    with span('title_lookup'):
+        lookup = lookup_for(new_df)
+        movie_idx = _movie_row(lookup, movie)
+
+    # Boolean mask over title rows already taken, starting with the selected movie
+    taken = np.zeros(len(lookup), dtype=bool)
+    taken[lookup.title_rows[movie_idx]] = True
+
+    results = {}
+    for col_name in strategies:
+        with span('rank_strategy', strategy=col_name, mode=RECOMMEND_MODE):
+            picks = _pick_unseen(lookup, _ranked_candidates(new_df, col_name, movie_idx), taken, k_per_strategy)
+            if len(picks) < k_per_strategy:
+                # Neighbour list exhausted by de-duplication, rank the full row instead
+                count('rank_fallback', strategy=col_name)
+                candidates = _ranked_candidates(new_df, col_name, movie_idx, full=True)
+                picks = _pick_unseen(lookup, candidates, taken, k_per_strategy)
+        taken[lookup.title_rows[picks]] = True
+        results[col_name] = rows_to_records(lookup, picks)
+
+    return results
+
+
+def _pick_unseen(lookup, candidates, taken, k):
+    title_rows = lookup.title_rows[candidates]
+    fresh = ~taken[title_rows]
+    candidates, title_rows = candidates[fresh], title_rows[fresh]
+    # Only the first occurrence of each title within this list
+    _, first = np.unique(title_rows, return_index=True)
+    return candidates[np.sort(first)[:k]]
+
+
 def vectorise(new_df, col_name):
-    cv = CountVectorizer(max_features=5000, stop_words='english')
-    vec_tags = cv.fit_transform(new_df[col_name]).toarray()
-    sim_bt = cosine_similarity(vec_tags)
+    vec_tags = feature_matrix(new_df[col_name])
+    sim_bt = sparse_similarity(vec_tags)
     return sim_bt
 
 
-@st.cache_data(show_spinner=False)
+# Shown for cast members whose details could not be fetched in time
+PERSON_PLACEHOLDER = "https://media.istockphoto.com/vectors/error-icon-vector-illustration-vector-id922024224?k=6&m" \
+                     "=922024224&s=612x612&w=0&h=LXl8Ul7bria6auAXKIjlvb6hRHkAodTqyqBeA6K7R54="
+
+# Total seconds the details page waits for its cast
+CAST_DEADLINE = 4
+
+
+def _person_details(data):
+    if not data or not data.get('profile_path'):
+        return PERSON_PLACEHOLDER, ""
+    return PROFILE_BASE_URL + data['profile_path'], data.get('biography') or " "
+
+
+@timed()
+def fetch_people_details(ids, timeout=CAST_DEADLINE):
+    """
+    Profile image URL and biography of several people, fetched concurrently under one
+    deadline for the whole batch. People not fetched in time, unknown to TMDB or skipped
+    while TMDB is failing get the placeholder; the order of `ids` is kept.
+    """
+    client = tmdb_client()
+    found = client.fetch_many(client.person, ids, timeout=timeout)
+    return [_person_details(found.get(id_)) for id_ in ids]
+
+
 def fetch_person_details(id_):
-    import time
-    max_retries = 3
-    retry_delay = 1
-    
-    for attempt in range(max_retries):
-        try:
-            data = requests.get(
-                'https://api.themoviedb.org/3/person/{}?api_key=6177b4297dff132d300422e0343471fb'.format(id_),
-                timeout=10
-            ).json()
-
-            try:
-                url = 'https://image.tmdb.org/t/p/w220_and_h330_face' + data['profile_path']
-
-                if data['biography']:
-                    biography = data['biography']
-                else:
-                    biography = " "
-
-            except:
-                url = "https://media.istockphoto.com/vectors/error-icon-vector-illustration-vector-id922024224?k=6&m" \
-                      "=922024224&s=612x612&w=0&h=LXl8Ul7bria6auAXKIjlvb6hRHkAodTqyqBeA6K7R54="
-                biography = ""
-
-            return url, biography
-            
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                continue
-            else:
-                # Return placeholder if all retries fail
-                url = "https://media.istockphoto.com/vectors/error-icon-vector-illustration-vector-id922024224?k=6&m" \
-                      "=922024224&s=612x612&w=0&h=LXl8Ul7bria6auAXKIjlvb6hRHkAodTqyqBeA6K7R54="
-                biography = ""
-                return url, biography
-        except Exception as e:
-            url = "https://media.istockphoto.com/vectors/error-icon-vector-illustration-vector-id922024224?k=6&m" \
-                  "=922024224&s=612x612&w=0&h=LXl8Ul7bria6auAXKIjlvb6hRHkAodTqyqBeA6K7R54="
-            biography = ""
-            return url, biography
-
-
-@st.cache_resource(show_spinner=False)
-def _load_movie_frames():
-    # Loading both the dataframes for fast reading
-    pickle_file_path = r'Files/movies_dict.pkl'
-    with open(pickle_file_path, 'rb') as pickle_file:
-        loaded_dict = pickle.load(pickle_file)
-
-    movies = pd.DataFrame.from_dict(loaded_dict)
-
-    pickle_file_path = r'Files/movies2_dict.pkl'
-    with open(pickle_file_path, 'rb') as pickle_file:
-        loaded_dict_2 = pickle.load(pickle_file)
-
-    movies2 = pd.DataFrame.from_dict(loaded_dict_2)
-
-    return movies, movies2
-
-
-def get_details(selected_movie_name):
-    movies, movies2 = _load_movie_frames()
-
-    # Extracting series of data to be displayed
-    a = pd.DataFrame(movies2[movies2['title'] == selected_movie_name])
-    b = pd.DataFrame(movies[movies['title'] == selected_movie_name])
+    # Fetched results are kept by the persistent TMDB cache, placeholders are not cached
+    return fetch_people_details([id_], timeout=10)[0]
+
+
+@timed()
+def get_details(new_df, selected_movie_name):
+    # Details come from the same artifact snapshot as new_df; the movie is a title or a row of new_df
+    movies, movies2 = artifacts_for(new_df).detail_frames()
+    row = _movie_row(lookup_for(new_df), selected_movie_name)
+
+    # Extracting series of data to be displayed; movies shares new_df's rows, movies2 is matched by id
+    a = movies2.iloc[lookup_for(movies2).row_for_id(lookup_for(new_df).movie_ids[row])]
+    b = movies.iloc[row]
 
     # Extracting necessary details
-    budget = a.iloc[0, 2]
-    overview = a.iloc[0, 3]
-    release_date = a.iloc[:, 5].iloc[0]
-    revenue = a.iloc[:, 6].iloc[0]
-    runtime = a.iloc[:, 7].iloc[0]
-    available_lang = ast.literal_eval(a.iloc[0, 8])
-    vote_rating = a.iloc[:, 10].iloc[0]
-    vote_count = a.iloc[:, 11].iloc[0]
-    movie_id = a.iloc[:, 0].iloc[0]
-    cast = b.iloc[:, 9].iloc[0]
-    director = b.iloc[:, 10].iloc[0]
-    genres = b.iloc[:, 3].iloc[0]
-    this_poster = fetch_posters(movie_id)
-    cast_per = b.iloc[:, 5].iloc[0]
-    a = ast.literal_eval(cast_per)
+    budget = a['budget']
+    overview = a['overview']
+    release_date = a['release_date']
+    revenue = a['revenue']
+    runtime = a['runtime']
+    available_lang = load_list(a['spoken_languages'])
+    vote_rating = a['vote_average']
+    vote_count = a['vote_count']
+    movie_id = a['movie_id']
+    cast = b['top_cast']
+    director = b['director']
+    genres = b['genres']
+    with span('fetch_posters'):
+        this_poster = fetch_posters(movie_id)
+    cast_per = b['cast']
+    a = load_list(cast_per)
     cast_id = []
     for i in a:
         cast_id.append(i['id'])
@@ -318,3 +341,14 @@ def get_details(selected_movie_name):
             vote_count, movie_id, cast, director, lang, cast_id]
 
     return info
+
+
+def top_cast_ids(new_df, movie_ids, depth=5):
+    # TMDB person ids of the first `depth` billed cast members, as shown on the details page
+    movies, _ = artifacts_for(new_df).detail_frames()
+    lookup = lookup_for(movies)
+    cast_ids = []
+    for movie_id in movie_ids:
+        cast = load_list(movies['cast'].iloc[lookup.row_for_id(movie_id)])
+        cast_ids.extend(person['id'] for person in cast[:depth])
+    return cast_ids
@@ -0,0 +1,314 @@
+"""
+Headless JSON API over the serving artifacts, without Streamlit's script reruns.
+
+    python -m processing.service --host 0.0.0.0 --port 8000
+
+    GET /recommend?title=Avatar&strategy=tags&k=25
+    GET /recommend/all?movie_id=19995&k=3
+    GET /recommend/blend?title=Avatar&weights=tags:1,genres:0.5&k=10
+    GET /details?title=Avatar&cast=1
+    GET /catalog?page=0&page_size=10&posters=1
+    GET /metrics
+    GET /health
+
+Movies are named by `title` or `movie_id`, resolved once to a catalog row. Requests
+are served on a thread per connection from the same process-wide artifact snapshot
+as the app, which is hot-swapped when a newer build lands on disk. Responses are
+cached as encoded JSON per snapshot for CINESCOPE_SERVICE_CACHE_TTL seconds, so
+repeated queries cost a dictionary lookup. Responses missing TMDB data (posters or
+cast not fetched in time) say so with `"partial": true` and are cached only briefly.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from processing import preprocess
+from processing.artifacts import current_artifacts
+from processing.lookup import lookup_for, rows_to_records
+from processing.metrics import count, prometheus_text, span
+from processing.similarity import STRATEGIES
+from processing.tmdb import poster_url, tmdb_client
+
+logger = logging.getLogger(__name__)
+
+# Seconds a response is reused; details and posters also reflect TMDB, so this is kept short
+SERVICE_CACHE_TTL = float(os.environ.get('CINESCOPE_SERVICE_CACHE_TTL', 300))
+
+# Seconds a partial response is reused, so missing TMDB data is retried soon
+SERVICE_PARTIAL_TTL = 5
+
+# Responses kept before the least recently used are dropped
+SERVICE_CACHE_ENTRIES = 4096
+
+# Largest k and page size a client may ask for
+MAX_K = 100
+MAX_PAGE_SIZE = 100
+
+# Names of the get_details() fields, in order
+DETAIL_FIELDS = ['poster', 'budget', 'genres', 'overview', 'release_date', 'revenue', 'runtime', 'spoken_languages',
+                 'vote_average', 'vote_count', 'movie_id', 'top_cast', 'director', 'languages', 'cast_ids']
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotInCatalog(LookupError):
+    pass
+
+
+class ResponseCache():
+    """
+    Thread-safe LRU of encoded responses with a TTL. Keys include the artifact
+    signature, so a hot-swapped build never serves answers from the old one.
+    """
+
+    def __init__(self, ttl=SERVICE_CACHE_TTL, max_entries=SERVICE_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, body, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _to_json(value):
+    # NumPy scalars and arrays from the frames are not JSON serialisable as they are
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+def _int(params, name, default, low=0, high=None):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer')
+    if high is None and value < low:
+        raise BadRequest(f'{name} must be at least {low}')
+    if high is not None and not low <= value <= high:
+        raise BadRequest(f'{name} must be between {low} and {high}')
+    return value
+
+
+def _movie_row(artifacts, params):
+    # The request names a movie by title or by TMDB id; the row is passed on, so a movie_id
+    # sharing its title with another film still answers for its own film
+    lookup = lookup_for(artifacts.new_df)
+    if 'movie_id' in params:
+        movie_id = _int(params, 'movie_id', None)
+        if movie_id not in lookup.id_to_row:
+            raise NotInCatalog(f'movie_id {movie_id} is not in the catalog')
+        return lookup.row_for_id(movie_id)
+    if 'title' in params:
+        if params['title'] not in lookup.title_to_row:
+            raise NotInCatalog(f"{params['title']!r} is not in the catalog")
+        return lookup.row(params['title'])
+    raise BadRequest('title or movie_id is required')
+
+
+def _movie(artifacts, row):
+    lookup = lookup_for(artifacts.new_df)
+    return {'title': lookup.titles[row], 'movie_id': lookup.movie_ids[row]}
+
+
+def _records(titles, movie_ids):
+    return [{'title': title, 'movie_id': movie_id} for title, movie_id in zip(titles, movie_ids)]
+
+
+def _strategy(params):
+    strategy = params.get('strategy', 'tags')
+    if strategy not in STRATEGIES:
+        raise BadRequest(f"strategy must be one of {', '.join(STRATEGIES)}")
+    return strategy
+
+
+def _weights(params):
+    # "tags:1,genres:0.5"; strategies left out count 0
+    weights = {}
+    for part in filter(None, params.get('weights', '').split(',')):
+        col_name, _, weight = part.partition(':')
+        if col_name not in STRATEGIES:
+            raise BadRequest(f'unknown strategy {col_name!r} in weights')
+        try:
+            weights[col_name] = float(weight)
+        except ValueError:
+            raise BadRequest(f'weight of {col_name} must be a number')
+    if not any(weights.values()):
+        raise BadRequest('weights needs at least one non-zero strategy:weight')
+    return weights
+
+
+def recommend_route(artifacts, params):
+    row, strategy = _movie_row(artifacts, params), _strategy(params)
+    titles, movie_ids = preprocess.recommend(artifacts.new_df, row, strategy, k=_int(params, 'k', 25, 1, MAX_K))
+    return {**_movie(artifacts, row), 'strategy': strategy, 'results': _records(titles, movie_ids)}
+
+
+def recommend_all_route(artifacts, params):
+    row = _movie_row(artifacts, params)
+    results = preprocess.recommend_all(artifacts.new_df, row, STRATEGIES, k_per_strategy=_int(params, 'k', 3, 1, MAX_K))
+    return {**_movie(artifacts, row),
+            'results': {col_name: _records(*records) for col_name, records in results.items()}}
+
+
+def recommend_blend_route(artifacts, params):
+    row, weights = _movie_row(artifacts, params), _weights(params)
+    titles, movie_ids = preprocess.recommend_hybrid(artifacts.new_df, row, weights, k=_int(params, 'k', 25, 1, MAX_K))
+    return {**_movie(artifacts, row), 'weights': weights, 'results': _records(titles, movie_ids)}
+
+
+def details_route(artifacts, params):
+    row = _movie_row(artifacts, params)
+    details = dict(zip(DETAIL_FIELDS, preprocess.get_details(artifacts.new_df, row)))
+    response = {**_movie(artifacts, row), 'details': details}
+    if details['poster'] is None:
+        response['partial'] = True
+    if params.get('cast') == '1':
+        # Same five people and placeholder rules as the details page
+        people = preprocess.fetch_people_details(details['cast_ids'][:5])
+        details['cast'] = [{'id': id_, 'profile': profile, 'biography': biography}
+                           for id_, (profile, biography) in zip(details['cast_ids'], people)]
+        if any(profile == preprocess.PERSON_PLACEHOLDER for profile, _ in people):
+            response['partial'] = True
+    return response
+
+
+def catalog_route(artifacts, params):
+    page_size = _int(params, 'page_size', 10, 1, MAX_PAGE_SIZE)
+    lookup = lookup_for(artifacts.movies)
+    pages = max(1, -(-len(lookup) // page_size))
+    page = _int(params, 'page', 0, 0, pages - 1)
+    titles, movie_ids = rows_to_records(lookup, np.arange(page * page_size, min((page + 1) * page_size, len(lookup))))
+    movies = _records(titles, movie_ids)
+    if params.get('posters') == '1':
+        client = tmdb_client()
+        found = client.fetch_many(client.movie, movie_ids, timeout=5)
+        for movie in movies:
+            movie['poster'] = poster_url(found[movie['movie_id']]) if movie['movie_id'] in found else None
+    response = {'page': page, 'page_size': page_size, 'pages': pages, 'movies': movies}
+    if any(movie.get('poster', '') is None for movie in movies):
+        response['partial'] = True
+    return response
+
+
+ROUTES = {
+    '/recommend': recommend_route,
+    '/recommend/all': recommend_all_route,
+    '/recommend/blend': recommend_blend_route,
+    '/details': details_route,
+    '/catalog': catalog_route,
+}
+
+_cache = ResponseCache()
+
+
+def handle(path, params, cache=_cache):
+    """
+    Answer one GET as (status, JSON body bytes). Successful responses are cached
+    per artifact snapshot, partial ones for SERVICE_PARTIAL_TTL seconds; errors are not.
+    """
+    route = ROUTES.get(path)
+    if route is None:
+        return 404, json.dumps({'error': f'no route {path}'}).encode()
+
+    artifacts = current_artifacts()
+    key = (artifacts.signature, path, tuple(sorted(params.items())))
+    body = cache.get(key)
+    if body is not None:
+        count('service_cache', route=path, result='hit')
+        return 200, body
+    count('service_cache', route=path, result='miss')
+
+    try:
+        with span('service_request', route=path):
+            response = route(artifacts, params)
+    except BadRequest as e:
+        return 400, json.dumps({'error': str(e)}).encode()
+    except NotInCatalog as e:
+        return 404, json.dumps({'error': str(e)}).encode()
+
+    body = json.dumps(response, default=_to_json).encode()
+    cache.put(key, body, SERVICE_PARTIAL_TTL if response.get('partial') else None)
+    return 200, body
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this, keep-alive clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        if path == '/health':
+            self._send(200, b'{"status":"ok"}')
+        elif path == '/metrics':
+            self._send(200, prometheus_text().encode(), 'text/plain; version=0.0.4')
+        else:
+            # Repeated parameters keep their last value
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                self._send(*handle(path, params))
+            except Exception:
+                logger.exception('Failed to answer %s', self.path)
+                self._send(500, b'{"error":"internal error"}')
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+def serve(host='127.0.0.1', port=8000):
+    # Artifacts are opened (or built) before the first request rather than during it
+    current_artifacts()
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    logger.info('Serving recommendations on http://%s:%d', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve CineScope recommendations as a JSON API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    serve(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+# Feature columns of new_df that get their own recommendation strategy
+STRATEGIES = ['tags', 'genres', 'keywords', 'tcast', 'tprduction_comp']
+
+# Number of neighbours kept per movie; recommend only ever shows the top 25
+NEIGHBOR_K = 50
+
+# 'neighbors' serves from the precomputed top-K index, 'query' computes one
+# similarity row per request from the stored feature matrix (linear-size artifacts),
+# 'ann' ranks only the candidates of an LSH index (linear build, for very large catalogs),
+# 'embedding' ranks by dot products of truncated-SVD embeddings (small dense vectors)
+RECOMMEND_MODE = os.environ.get('CINESCOPE_RECOMMEND_MODE', 'neighbors')
+
+# Vocabulary size of the bag of words built for each strategy
+MAX_FEATURES = 5000
+
+# Similarity scores are ranked after rounding to this many decimals
+SCORE_DECIMALS = 5
+
+# Dense similarity values (float32 bytes) one block of rows may hold while it is reduced to its top K;
+# CINESCOPE_SIMILARITY_BLOCK_ROWS fixes the rows per block instead
+SIMILARITY_BLOCK_BYTES = 64 * 2 ** 20
+SIMILARITY_BLOCK_ROWS = int(os.environ.get('CINESCOPE_SIMILARITY_BLOCK_ROWS', 0)) or None
+
+
+def feature_matrix(texts, max_features=MAX_FEATURES):
+    """
+    Bag of words for a column of texts as an L2-normalised float32 CSR matrix.
+    The dot product of two rows is their cosine similarity.
+    """
+    return build_features(texts, max_features)[0]
+
+
+def build_features(texts, max_features=MAX_FEATURES, vocabulary=None):
+    """
+    Same as feature_matrix, also returning the vocabulary in column order. With a
+    fixed vocabulary the texts are only transformed, so new rows stay comparable.
+    """
+    if vocabulary is not None:
+        max_features = None
+    cv = CountVectorizer(max_features=max_features, stop_words='english', dtype=np.float32, vocabulary=vocabulary)
+    counts = cv.fit_transform(texts)
+    features = normalize(counts, norm='l2', copy=False).tocsr()
+    return features, cv.get_feature_names_out().tolist()
+
+
+def analyzer():
+    # Tokenisation used for every feature matrix, e.g. to spot terms outside a vocabulary
+    return CountVectorizer(stop_words='english').build_analyzer()
+
+
+def sparse_similarity(features):
+    # Cosine similarity of normalised rows as a sparse product; never densifies the features.
+    # The result is N x N, so builds use blocked_neighbors instead
+    return features @ features.T
+
+
+def block_rows(n, block_bytes=SIMILARITY_BLOCK_BYTES):
+    # Rows per block so a dense block x catalog similarity stays within block_bytes
+    if SIMILARITY_BLOCK_ROWS:
+        return SIMILARITY_BLOCK_ROWS
+    return int(max(1, min(4096, block_bytes // (4 * max(n, 1)))))
+
+
+def settle(scores):
+    # Rounded so equal cosines computed in a different order still tie, and ties go to the lower row
+    return np.round(np.asarray(scores, dtype=np.float32), SCORE_DECIMALS)
+
+
+def query_scores(features, row):
+    # One similarity row computed on demand as a single sparse mat-vec product
+    return settle((features @ features[row].T).toarray().ravel())
+
+
+def stack_features(blocks):
+    """
+    Strategy feature matrices side by side in one CSR matrix, with the first column
+    of each block in `offsets`. Row products then sum the per-strategy cosines.
+    """
+    offsets = np.cumsum([0] + [block.shape[1] for block in blocks])
+    return sp.hstack(blocks, format='csr', dtype=np.float32), offsets
+
+
+def hybrid_scores(stacked, offsets, row, weights):
+    """
+    Weighted sum of the strategy similarities of `row` with every movie, as one sparse
+    mat-vec product: only the query vector is scaled, block by block, by `weights`.
+    """
+    query = stacked[row].tocsr(copy=True)
+    blocks = np.searchsorted(offsets, query.indices, side='right') - 1
+    query.data *= np.asarray(weights, dtype=np.float32)[blocks]
+    return settle((stacked @ query.T).toarray().ravel())
+
+
+def top_k_indices(scores, k, exclude=()):
+    """
+    Positions of the k highest scores, best first, skipping the positions in exclude.
+    Uses partial selection so only the k winners get sorted.
+    """
+    scores = np.array(scores, dtype=np.float32)
+    if len(exclude):
+        scores[np.fromiter(exclude, dtype=np.int64)] = -np.inf
+    k = max(0, min(k, len(scores) - len(exclude)))
+    if k == 0:
+        return np.empty(0, dtype=np.int32)
+
+    # Every candidate tied with the k-th score is kept, so ties resolve to the lower position
+    kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+    idx = np.flatnonzero(scores >= kth)
+    order = np.lexsort((idx, -scores[idx]))[:k]
+    return idx[order].astype(np.int32)
+
+
+def first_k_allowed(candidates, k, exclude=()):
+    """
+    First k entries of an already ranked candidate list that are not in exclude.
+    Returns None when the list runs out, so the caller can fall back to a full row.
+    """
+    candidates = np.asarray(candidates)
+    if len(exclude):
+        candidates = candidates[~np.isin(candidates, np.fromiter(exclude, dtype=np.int64))]
+    if len(candidates) < k:
+        return None
+    return candidates[:k]
+
+
+def top_k_neighbors(sim, k=NEIGHBOR_K):
+    """
+    Reduce a square similarity matrix to the k best neighbours of every row.
+    The movie itself is excluded. Returns (indices int32, scores float32),
+    both of shape (n, k) and ordered by descending score.
+    """
+    n = sim.shape[0]
+    return top_k_block(sim, np.arange(n), min(k, n - 1))
+
+
+def blocked_neighbors(features, k=NEIGHBOR_K, rows_per_block=None):
+    """
+    Same result as top_k_neighbors(sparse_similarity(features)), computed one block of
+    rows at a time. Each block x catalog product is reduced to its top k before the
+    next one, so peak memory follows the block size, not the square of the catalog.
+    """
+    n = features.shape[0]
+    k = max(0, min(k, n - 1))
+    rows_per_block = rows_per_block or block_rows(n)
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, rows_per_block):
+        rows = np.arange(start, min(start + rows_per_block, n))
+        indices[rows], scores[rows] = top_k_block(features[rows] @ features.T, rows, k)
+    return indices, scores
+
+
+def top_k_block(sim, rows, k):
+    """
+    Top-k neighbours for a block of similarity rows. `rows` are the positions of
+    those movies in the catalog, so each one can be excluded from its own list.
+    """
+    m, n = sim.shape
+    k = max(0, k)
+    if sp.issparse(sim):
+        # A fresh dense array, so it is settled in place rather than copied once more
+        sim = sim.toarray().astype(np.float32, copy=False)
+        np.round(sim, SCORE_DECIMALS, out=sim)
+    else:
+        sim = settle(sim)
+    sim[np.arange(m), rows] = -np.inf
+
+    if k == 0:
+        return np.empty((m, 0), dtype=np.int32), np.empty((m, 0), dtype=np.float32)
+
+    # Partial selection of the k winners, then a sort of only those
+    idx = np.argpartition(sim, n - k, axis=1)[:, n - k:]
+    scores = np.take_along_axis(sim, idx, axis=1)
+
+    # Ties are broken by row position so the order matches a stable full sort
+    order = np.lexsort((idx, -scores))
+    idx = np.take_along_axis(idx, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+
+    # Rows where the k-th score is shared beyond the cut are redone one by one
+    tied = (sim >= scores[:, -1:]).sum(axis=1) > k
+    for row in np.flatnonzero(tied):
+        idx[row] = top_k_indices(sim[row], k)
+        scores[row] = sim[row, idx[row]]
+
+    return idx.astype(np.int32), scores.astype(np.float32)
+
+
+def update_neighbors(features, indices, scores, affected, block_size=1024):
+    """
+    Refresh a top-K neighbour index after the feature rows in `affected` changed.
+    New movies are rows appended after the old ones and must be in `affected` too.
+    Only affected rows and rows whose list held an affected movie are recomputed;
+    every other row merges the new scores of the affected movies into its list.
+    """
+    n = features.shape[0]
+    old_n, k = indices.shape
+    affected = np.unique(np.asarray(affected, dtype=np.int64))
+
+    new_indices = np.empty((n, k), dtype=np.int32)
+    new_scores = np.empty((n, k), dtype=np.float32)
+    new_indices[:old_n] = indices
+    new_scores[:old_n] = scores
+
+    is_affected = np.zeros(n, dtype=bool)
+    is_affected[affected] = True
+    recompute = np.union1d(affected, np.flatnonzero(is_affected[np.asarray(indices)].any(axis=1)))
+    merge = np.setdiff1d(np.arange(old_n), recompute)
+
+    for start in range(0, len(recompute), block_size):
+        rows = recompute[start:start + block_size]
+        new_indices[rows], new_scores[rows] = top_k_block(features[rows] @ features.T, rows, k)
+
+    if len(affected) and len(merge):
+        cross = features[affected] @ features.T
+        for start in range(0, len(merge), block_size):
+            rows = merge[start:start + block_size]
+            # Unaffected pairs are unchanged, so the old list plus the affected movies is enough
+            cand_idx = np.hstack([new_indices[rows], np.broadcast_to(affected, (len(rows), len(affected)))])
+            cand_scores = np.hstack([new_scores[rows], settle(cross[:, rows].toarray().T)])
+            order = np.lexsort((cand_idx, -cand_scores))[:, :k]
+            new_indices[rows] = np.take_along_axis(cand_idx, order, axis=1)
+            new_scores[rows] = np.take_along_axis(cand_scores, order, axis=1)
+
+    return new_indices, new_scores
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Every artifact is a directory of plain .npy arrays under Files/. The .npy header
+# carries dtype and shape, so loading is an mmap and the OS page cache is shared
+# between all server processes on the host.
+ARTIFACT_DIR = 'Files'
+
+
+def artifact_path(name):
+    return os.path.join(ARTIFACT_DIR, name)
+
+
+def save_arrays(path, meta=None, **arrays):
+    # Written next to the target first, then moved into place in one rename; the pid keeps
+    # processes from clearing each other's half-written directories
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+    if meta is not None:
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+    # The old directory is moved aside first so the target is missing only between two renames
+    old_path = f'{path}.{os.getpid()}.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_arrays(path, *names):
+    return tuple(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in names)
+
+
+def save_csr(path, matrix, meta=None):
+    matrix = matrix.tocsr()
+    save_arrays(path, meta=meta, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                shape=np.array(matrix.shape, dtype=np.int64))
+
+
+def load_csr(path):
+    data, indices, indptr, shape = load_arrays(path, 'data', 'indices', 'indptr', 'shape')
+    return sp.csr_matrix((data, indices, indptr), shape=(int(shape[0]), int(shape[1])), copy=False)
+
+
+def load_meta(path):
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        return json.load(meta_file)
+
+
+def _encode_strings(values):
+    # UTF-8 blob plus offsets, so a text column is two flat, mmap-able arrays
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data, offsets):
+    blob = data.tobytes()
+    return [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def save_frame(path, df):
+    """
+    Columnar layout for a dataframe: numeric columns are stored as typed .npy arrays,
+    text columns as a UTF-8 blob with offsets and list/mixed columns as JSON text.
+    Column order and kinds are kept in meta.json; the index is not stored (rows are positional).
+    """
+    arrays = {}
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if values.dtype.kind in 'biuf':
+            kind = 'numeric'
+            arrays[col] = values.to_numpy()
+        else:
+            values = values.tolist()
+            if all(isinstance(value, str) for value in values):
+                kind = 'str'
+            else:
+                kind = 'json'
+                values = [json.dumps(value) for value in values]
+            arrays[f'{col}.data'], arrays[f'{col}.offsets'] = _encode_strings(values)
+        columns.append({'name': col, 'kind': kind})
+
+    save_arrays(path, meta={'columns': columns, 'rows': len(df)}, **arrays)
+
+
+def load_frame(path, columns=None):
+    """
+    Load a frame written by save_frame. Only the requested columns are read from disk;
+    numeric columns stay memory-mapped until pandas copies them.
+    """
+    meta = load_meta(path)
+    data = {}
+    for column in meta['columns']:
+        name, kind = column['name'], column['kind']
+        if columns is not None and name not in columns:
+            continue
+        if kind == 'numeric':
+            data[name], = load_arrays(path, name)
+        else:
+            values = _decode_strings(*load_arrays(path, f'{name}.data', f'{name}.offsets'))
+            if kind == 'json':
+                values = [json.loads(value) for value in values]
+            data[name] = values
+
+    return pd.DataFrame(data, index=pd.RangeIndex(meta['rows']))
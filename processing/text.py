@@ -0,0 +1,33 @@
+from functools import lru_cache
+from nltk.corpus import stopwords
+from nltk.stem.porter import PorterStemmer
+
+# Distinct tokens whose stems are remembered; word frequencies are Zipfian, so hits dominate
+STEM_CACHE_SIZE = 100_000
+
+
+class Normaliser():
+    """
+    Stems tokens, drops English stopwords and tokens of two characters or less, and
+    joins the rest into one string. The stopword set is built once and stems are
+    memoised in a bounded LRU cache, so one instance should be reused for a whole column.
+    """
+
+    def __init__(self, cache_size=STEM_CACHE_SIZE):
+        self.stop_words = frozenset(stopwords.words('english'))
+        self._stem = lru_cache(maxsize=cache_size)(PorterStemmer().stem)
+
+    def normalise(self, tokens):
+        kept = []
+        for token in tokens:
+            word = self._stem(token).lower()
+            if word not in self.stop_words and len(word) > 2:
+                kept.append(word)
+        # Trailing space kept for compatibility with the stored tags
+        return ' '.join(kept) + ' ' if kept else ''
+
+    def normalise_column(self, column):
+        return [self.normalise(tokens) for tokens in column]
+
+    def cache_info(self):
+        return self._stem.cache_info()
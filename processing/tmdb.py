@@ -0,0 +1,269 @@
+"""
+Process-wide TMDB client.
+
+All TMDB calls go through one keep-alive connection pool, one token-bucket rate
+limiter and one bounded worker pool, so a page of posters reuses a single
+connection setup instead of opening one per request. Movie and person lookups are
+answered from the persistent metadata cache first. The base URL can be pointed at a
+local stub server with CINESCOPE_TMDB_URL.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from processing.metrics import count, span
+from processing.tmdb_cache import MISSING, MetadataCache
+
+TMDB_URL = os.environ.get('CINESCOPE_TMDB_URL', 'https://api.themoviedb.org/3')
+TMDB_API_KEY = os.environ.get('TMDB_API_KEY', '6177b4297dff132d300422e0343471fb')
+
+# Serve movie and person metadata from the local cache only, never calling TMDB
+TMDB_OFFLINE = os.environ.get('CINESCOPE_TMDB_OFFLINE', '') not in ('', '0')
+
+# TMDB allows roughly 50 requests a second per IP; stay a little below it
+TMDB_RATE = 40.0
+TMDB_BURST = 20
+
+# Concurrent TMDB requests per process, and kept-alive connections to match
+TMDB_WORKERS = 10
+
+# Seconds a single request may take when the caller gives no deadline
+TMDB_TIMEOUT = 3.0
+
+# Consecutive failures that open the circuit, and seconds before a trial request is let through
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30.0
+
+POSTER_BASE_URL = 'https://image.tmdb.org/t/p/w300'
+PROFILE_BASE_URL = 'https://image.tmdb.org/t/p/w220_and_h330_face'
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+class NotFound(requests.exceptions.HTTPError):
+    pass
+
+
+class OfflineMiss(requests.exceptions.RequestException):
+    pass
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    pass
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket: `rate` tokens a second, at most `capacity` saved up.
+    """
+
+    def __init__(self, rate=TMDB_RATE, capacity=TMDB_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        # Returns False instead of waiting past the deadline
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+
+class CircuitBreaker():
+    """
+    Fails fast while TMDB is unhealthy. After `failures` consecutive failed requests
+    the circuit opens; once `reset_timeout` seconds have passed one trial request is
+    let through, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened = None
+        self._trial = False
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._count = 0
+                self._opened = None
+                return
+            self._count += 1
+            if self._opened is not None or self._count >= self.failures:
+                self._opened = time.monotonic()
+
+
+class TMDBClient():
+    """
+    Rate-limited TMDB access over a pooled requests.Session. get_json() blocks the
+    calling thread; fetch_many() runs calls on the shared worker pool and returns
+    whatever finished before the deadline. With a cache, movie() and person() go to
+    TMDB only on a miss, and in offline mode not at all.
+    """
+
+    def __init__(self, base_url=TMDB_URL, api_key=TMDB_API_KEY, rate=TMDB_RATE, burst=TMDB_BURST,
+                 workers=TMDB_WORKERS, timeout=TMDB_TIMEOUT, cache=None, offline=False):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tmdb')
+
+    def get_json(self, path, timeout=None, deadline=None):
+        """
+        GET base_url + path and decode the JSON body. `deadline` is a time.monotonic()
+        value covering the wait for a token as well as the request itself.
+        """
+        with span('tmdb_request', endpoint=path.split('/')[1]):
+            return self._get_json(path, timeout, deadline)
+
+    def _get_json(self, path, timeout, deadline):
+        timeout = timeout or self.timeout
+        deadline = min(deadline, time.monotonic() + timeout) if deadline else time.monotonic() + timeout
+        if not self.bucket.acquire(deadline):
+            raise DeadlineExceeded(f'rate limit wait for {path} would pass the deadline')
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f'deadline passed before {path} was sent')
+        if not self.breaker.allow():
+            raise CircuitOpen(f'TMDB is failing; {path} not requested')
+
+        try:
+            response = self.session.get(f'{self.base_url}{path}', params={'api_key': self.api_key},
+                                        timeout=remaining)
+        except requests.exceptions.RequestException:
+            self.breaker.record(False)
+            raise
+        # Server errors count against TMDB's health, answers like 404 do not
+        self.breaker.record(response.status_code < 500)
+        if response.status_code == 404:
+            raise NotFound(f'{path} does not exist on TMDB', response=response)
+        response.raise_for_status()
+        return response.json()
+
+    def cached_json(self, kind, key, path, complete_field, **kwargs):
+        """
+        get_json() through the metadata cache. Responses without `complete_field`
+        (e.g. a movie with no poster yet) are cached for the shorter negative TTL.
+        """
+        if self.cache is None:
+            return self.get_json(path, **kwargs)
+
+        value, fresh = self.cache.get(kind, key, allow_expired=True)
+        if value is not None and (fresh or self.offline):
+            count('tmdb_cache', kind=kind, result='negative_hit' if value is MISSING else 'hit')
+            if value is MISSING:
+                raise NotFound(f'{path} is cached as missing')
+            return value
+        count('tmdb_cache', kind=kind, result='miss' if value is None else 'expired')
+        if self.offline:
+            raise OfflineMiss(f'{path} is not cached and TMDB access is disabled')
+
+        try:
+            data = self.get_json(path, **kwargs)
+        except NotFound:
+            self.cache.put(kind, key, MISSING)
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, CircuitOpen):
+            # An expired entry is still better than nothing while TMDB is unreachable
+            if value is not None and value is not MISSING:
+                count('tmdb_cache', kind=kind, result='stale_served')
+                return value
+            raise
+        self.cache.put(kind, key, data, negative=not data.get(complete_field))
+        return data
+
+    def movie(self, movie_id, **kwargs):
+        return self.cached_json('movie', movie_id, f'/movie/{movie_id}', 'poster_path', **kwargs)
+
+    def person(self, person_id, **kwargs):
+        return self.cached_json('person', person_id, f'/person/{person_id}', 'profile_path', **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def fetch_many(self, fn, keys, timeout=None):
+        """
+        Call fn(key, deadline=...) for every key on the shared pool. Returns
+        {key: result}; keys that failed or missed the deadline are left out.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        futures = {self._executor.submit(fn, key, deadline=deadline): key for key in keys}
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        for future in not_done:
+            future.cancel()
+
+        results = {}
+        for future in done:
+            if future.exception() is None:
+                results[futures[future]] = future.result()
+        count('tmdb_fetch', len(results), result='ok')
+        count('tmdb_fetch', len(done) - len(results), result='failed')
+        count('tmdb_fetch', len(not_done), result='late')
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def tmdb_client():
+    # One client per process, shared by every Streamlit session
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TMDBClient(cache=MetadataCache(), offline=TMDB_OFFLINE)
+    return _client
+
+
+def poster_url(data):
+    if data.get('poster_path'):
+        return POSTER_BASE_URL + data['poster_path']
+    return None
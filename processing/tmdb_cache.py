@@ -0,0 +1,117 @@
+"""
+Persistent TMDB metadata cache.
+
+Movie and person JSON is kept in a SQLite file under Files/, so it survives restarts
+and is shared by every process on the host. Entries expire after a TTL; lookups that
+found nothing (a 404, or a movie without a poster) are cached too, with a shorter TTL.
+When the file grows past its size limit the least recently used entries are evicted.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from processing.store import artifact_path
+
+TMDB_CACHE_PATH = os.environ.get('CINESCOPE_TMDB_CACHE', artifact_path('tmdb_cache.sqlite'))
+
+# Seconds an entry is served before TMDB is asked again; misses are retried sooner
+CACHE_TTL = 7 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+
+# Bytes of JSON kept before least recently used entries are evicted
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Last-access times are only rewritten this often (seconds), so hits rarely write
+ACCESS_RESOLUTION = 60
+
+# Sentinel for a cached "TMDB has nothing under this key"
+MISSING = object()
+
+
+class MetadataCache():
+    """
+    kind/key -> JSON store with TTL, negative entries and LRU eviction. Safe to share
+    between threads; several processes can use the same file.
+    """
+
+    def __init__(self, path=TMDB_CACHE_PATH, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, body TEXT, negative INTEGER, '
+                         'expires REAL, accessed REAL, size INTEGER, PRIMARY KEY (kind, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def get(self, kind, key, allow_expired=False):
+        """
+        Returns (value, fresh): value is the decoded JSON, MISSING for a cached miss,
+        or None when nothing usable is stored.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT body, expires, accessed FROM entries WHERE kind = ? AND key = ?',
+                                   (kind, str(key))).fetchone()
+            if row is None:
+                return None, False
+            body, expires, accessed = row
+            fresh = expires > now
+            if not fresh and not allow_expired:
+                return None, False
+            if now - accessed > ACCESS_RESOLUTION:
+                self._db.execute('UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?', (now, kind, str(key)))
+        return (MISSING if body is None else json.loads(body)), fresh
+
+    def put(self, kind, key, value, negative=False):
+        """
+        Store a JSON value, or MISSING for a lookup that found nothing. negative=True
+        keeps a found but incomplete value (e.g. no poster) only for negative_ttl.
+        """
+        body = None if value is MISSING else json.dumps(value, separators=(',', ':'))
+        negative = negative or body is None
+        now = time.time()
+        expires = now + (self.negative_ttl if negative else self.ttl)
+        size = len(body) if body else 0
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (kind, str(key), body, int(negative), expires, now, size))
+            self._puts += 1
+            # Summing sizes is a table scan, so the limit is only checked every 64 writes
+            if self._puts % 64 == 1:
+                self._evict()
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Expired entries go first, then the least recently used down to 90% of the limit
+        self._db.execute('DELETE FROM entries WHERE expires < ?', (time.time(),))
+        excess = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0] - self.max_bytes * 0.9
+        if excess <= 0:
+            return
+        freed = 0
+        stale = []
+        for kind, key, size in self._db.execute('SELECT kind, key, size FROM entries ORDER BY accessed'):
+            stale.append((kind, key))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany('DELETE FROM entries WHERE kind = ? AND key = ?', stale)
+
+    def stats(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(negative), 0) '
+                                    'FROM entries').fetchone()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,22 @@
+import pytest
+from benchmarks.synthetic import generate
+from processing.artifacts import ArtifactManager
+from processing.display import Main
+
+# Movies in the synthetic catalog built for each test
+ROWS = 200
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    # A scratch directory whose Files/ holds a small synthetic corpus and its artifacts
+    generate(str(tmp_path / 'Files'), ROWS, seed=0, workers=1)
+    monkeypatch.chdir(tmp_path)
+    with Main() as bot:
+        bot.main_()
+    return tmp_path
+
+
+def open_snapshot():
+    # A manager of its own, so every test starts from what is on disk
+    return ArtifactManager(check_interval=0).get()
@@ -0,0 +1,45 @@
+"""
+Bulk export over a freshly built catalog and over neighbour lists left from an older one.
+"""
+import json
+import pandas as pd
+from processing import display
+from processing.export import export
+from processing.similarity import query_scores, top_k_indices
+from processing.store import artifact_path, load_csr, load_frame
+from tests.conftest import ROWS, open_snapshot
+
+
+def exported(path):
+    with open(path, encoding='utf-8') as export_file:
+        return [json.loads(line) for line in export_file]
+
+
+def expected(col_name, row, k):
+    # The exact ranking, as preprocess.recommend computes it in query mode
+    features = load_csr(artifact_path(f'features_{col_name}'))
+    movie_ids = load_frame(artifact_path('new_df'), ['movie_id'])['movie_id'].to_numpy()
+    return movie_ids[top_k_indices(query_scores(features, row), k, exclude=(row,))].tolist()
+
+
+def test_export_matches_exact_ranking(catalog):
+    assert export('similar.jsonl', k=3, strategies=['tags'], workers=1) == ROWS
+    lines = exported('similar.jsonl')
+
+    assert [movie['similar']['tags'][0]['movie_id'] for movie in lines[:20]] == \
+        [expected('tags', row, 1)[0] for row in range(20)]
+
+
+def test_export_ignores_neighbors_of_an_older_catalog(catalog, monkeypatch):
+    movies_path = artifact_path('tmdb_5000_movies.csv')
+    movies = pd.read_csv(movies_path)
+    movies.iloc[:-20].to_csv(movies_path, index=False)
+    monkeypatch.setattr(display, 'RECOMMEND_MODE', 'query')
+    open_snapshot()
+
+    assert export('similar.jsonl', k=3, strategies=['genres'], workers=1) == ROWS - 20
+    lines = exported('similar.jsonl')
+
+    row = len(lines) - 1
+    assert [neighbor['movie_id'] for neighbor in lines[row]['similar']['genres']] == expected('genres', row, 3)
+    assert all(len(movie['similar']['genres']) == 3 for movie in lines)
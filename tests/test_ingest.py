@@ -0,0 +1,68 @@
+"""
+Incremental ingest followed by builds that rebuild only part of the artifacts.
+
+Each test runs in a scratch directory whose Files/ holds a small synthetic corpus.
+"""
+import os
+import shutil
+import pandas as pd
+import pytest
+from benchmarks.synthetic import generate
+from processing import display, preprocess
+from processing.build import load_manifest, read_build_id
+from processing.ingest import ingest_delta
+from processing.similarity import STRATEGIES
+from processing.store import artifact_path
+from tests.conftest import ROWS, open_snapshot
+
+
+def write_delta(directory):
+    # Ten changed movies (ids 190-199) and ten new ones, drawn from another seed
+    movies_path, credits_path = generate(str(directory / 'delta'), ROWS + 10, seed=1, workers=1)
+    for path, key in ((movies_path, 'id'), (credits_path, 'movie_id')):
+        frame = pd.read_csv(path)
+        frame[frame[key] >= ROWS - 10].to_csv(path, index=False)
+    return movies_path, credits_path
+
+
+def test_ingest_updates_every_artifact(catalog):
+    ingest_delta(*write_delta(catalog))
+    artifacts = open_snapshot()
+
+    assert len(artifacts.new_df) == ROWS + 10
+    assert read_build_id() == artifacts.signature
+    for col_name in STRATEGIES:
+        assert artifacts.features(col_name).shape[0] == ROWS + 10
+        assert artifacts.neighbors(col_name)[0].shape[0] == ROWS + 10
+    titles, _ = preprocess.recommend(artifacts.new_df, ROWS + 5, 'tags', k=5)
+    assert len(titles) == 5
+
+
+def test_partial_rebuild_after_ingest_rebuilds_every_incremental_artifact(catalog):
+    ingest_delta(*write_delta(catalog))
+    shutil.rmtree(artifact_path('neighbors_tags'))
+
+    artifacts = open_snapshot()
+
+    manifest = load_manifest()
+    assert not manifest['incremental']
+    assert len(artifacts.new_df) == ROWS + 10
+    for col_name in STRATEGIES:
+        assert os.path.exists(os.path.join(artifact_path(f'features_{col_name}'), 'data.npy'))
+        assert artifacts.neighbors(col_name)[0].shape[0] == ROWS + 10
+    assert preprocess.recommend(artifacts.new_df, ROWS + 5, 'keywords', k=5)[0]
+
+
+def test_snapshot_skips_stale_artifacts_of_another_mode(catalog, monkeypatch):
+    # Fewer movies in the CSVs, then a start in query mode: the neighbour lists on disk are for the old catalog
+    movies_path = artifact_path('tmdb_5000_movies.csv')
+    movies = pd.read_csv(movies_path)
+    movies.iloc[:-20].to_csv(movies_path, index=False)
+    monkeypatch.setattr(display, 'RECOMMEND_MODE', 'query')
+
+    artifacts = open_snapshot()
+
+    assert len(artifacts.new_df) == ROWS - 20
+    assert os.path.exists(artifact_path('neighbors_tags'))
+    with pytest.raises(KeyError):
+        artifacts.neighbors('tags')
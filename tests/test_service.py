@@ -0,0 +1,40 @@
+"""
+Status codes of the JSON API for malformed, unknown and failing requests.
+"""
+import json
+import pytest
+from processing import preprocess, service
+from tests.conftest import open_snapshot
+
+
+@pytest.fixture
+def handle(catalog, monkeypatch):
+    artifacts = open_snapshot()
+    monkeypatch.setattr(service, 'current_artifacts', lambda: artifacts)
+    return lambda path, **params: service.handle(path, params, cache=service.ResponseCache())
+
+
+def test_known_movie_is_answered(handle):
+    status, body = handle('/recommend', movie_id='10', k='3')
+    assert status == 200
+    assert json.loads(body)['movie_id'] == 10
+    assert len(json.loads(body)['results']) == 3
+
+
+@pytest.mark.parametrize('movie_id', ['abc', '-3', '1.5'])
+def test_malformed_movie_id_is_a_bad_request(handle, movie_id):
+    assert handle('/recommend', movie_id=movie_id)[0] == 400
+
+
+def test_unknown_movie_is_not_found(handle):
+    assert handle('/recommend', movie_id='123456')[0] == 404
+    assert handle('/details', title='No Such Movie')[0] == 404
+
+
+def test_internal_lookup_errors_are_not_reported_as_not_found(handle, monkeypatch):
+    def fail(*args, **kwargs):
+        raise KeyError(5)
+
+    monkeypatch.setattr(preprocess, 'recommend', fail)
+    with pytest.raises(KeyError):
+        handle('/recommend', movie_id='10')
@@ -0,0 +1,157 @@
+"""
+TMDB client against a local stub server: deadlines, negative caching and the circuit breaker.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from processing.tmdb import CircuitBreaker, CircuitOpen, NotFound, TMDBClient
+from processing.tmdb_cache import MISSING, MetadataCache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Movie ids the stub answers specially
+UNKNOWN_ID = 404
+SLOW_ID = 999
+SLOW_SECONDS = 2.0
+
+
+class StubTMDB(BaseHTTPRequestHandler):
+    """
+    /movie/<id> and /person/<id> with a poster or profile path; UNKNOWN_ID is a 404,
+    SLOW_ID answers after SLOW_SECONDS, and every path fails with 500 while `failing` is set.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        with server.lock:
+            server.hits[path] = server.hits.get(path, 0) + 1
+        kind, _, key = path.strip('/').partition('/')
+
+        if server.failing:
+            self._send(500, {'status_message': 'stub failure'})
+        elif key == str(UNKNOWN_ID):
+            self._send(404, {'status_message': 'not found'})
+        else:
+            if key == str(SLOW_ID):
+                time.sleep(SLOW_SECONDS)
+            field = 'poster_path' if kind == 'movie' else 'profile_path'
+            self._send(200, {'id': int(key), field: f'/{kind}{key}.jpg', 'biography': 'stub'})
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTMDB)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.hits = {}
+    server.failing = False
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub, tmp_path):
+    client = TMDBClient(base_url=stub.url, api_key='test', cache=MetadataCache(str(tmp_path / 'cache.sqlite')))
+    yield client
+    client.close()
+
+
+def test_fetch_many_returns_what_finished_before_the_deadline(client):
+    started = time.monotonic()
+    found = client.fetch_many(client.movie, [1, 2, SLOW_ID, UNKNOWN_ID], timeout=0.5)
+    elapsed = time.monotonic() - started
+
+    assert set(found) == {1, 2}
+    assert found[1]['poster_path'] == '/movie1.jpg'
+    assert elapsed < SLOW_SECONDS
+
+
+def test_not_found_is_cached_as_missing(client, stub):
+    for _ in range(3):
+        with pytest.raises(NotFound):
+            client.movie(UNKNOWN_ID)
+
+    assert stub.hits[f'/movie/{UNKNOWN_ID}'] == 1
+    assert client.cache.get('movie', UNKNOWN_ID)[0] is MISSING
+
+
+def test_found_movies_are_served_from_the_cache(client, stub):
+    assert client.movie(7) == client.movie(7)
+    assert stub.hits['/movie/7'] == 1
+
+
+def test_breaker_opens_lets_one_trial_through_and_closes():
+    breaker = CircuitBreaker(failures=2, reset_timeout=0.2)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.is_open and not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.allow()
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record(True)
+    assert not breaker.is_open and breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failures=1, reset_timeout=0.2)
+    breaker.record(False)
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.is_open and not breaker.allow()
+
+
+def test_client_stops_calling_a_failing_server(client, stub):
+    client.breaker = CircuitBreaker(failures=2, reset_timeout=0.2)
+    stub.failing = True
+    for person_id in (1, 2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.person(person_id)
+
+    with pytest.raises(CircuitOpen):
+        client.person(3)
+    assert '/person/3' not in stub.hits
+
+    # The trial after the reset timeout succeeds and closes the circuit
+    stub.failing = False
+    time.sleep(0.25)
+    assert client.person(3)['profile_path'] == '/person3.jpg'
+    assert not client.breaker.is_open
+
+
+def test_base_url_comes_from_the_environment(stub, tmp_path):
+    # The process-wide client is configured at import, so it is checked in a fresh interpreter
+    env = dict(os.environ, CINESCOPE_TMDB_URL=stub.url, CINESCOPE_TMDB_CACHE=str(tmp_path / 'cache.sqlite'),
+               PYTHONPATH=REPO_DIR)
+    code = 'from processing.tmdb import poster_url, tmdb_client; print(poster_url(tmdb_client().movie(5)))'
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=tmp_path, capture_output=True, text=True,
+                            check=True).stdout
+
+    assert output.strip().endswith('/movie5.jpg')
+    assert stub.hits['/movie/5'] == 1